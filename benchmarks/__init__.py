@@ -0,0 +1,9 @@
+"""
+Benchmarks
+
+Micro-benchmarks of the Product model and macro-benchmarks of the REST API,
+run at several table sizes against Postgres or a SQLite stand-in:
+
+    python -m benchmarks.run --database sqlite:///benchmarks.db --rows 1000 100000
+    python -m benchmarks.compare before.json after.json
+"""
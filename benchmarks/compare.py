@@ -0,0 +1,60 @@
+"""
+Benchmark comparison
+
+Compares the median times of two result files written by benchmarks.run:
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+"""
+import sys
+import json
+import argparse
+
+
+def load(path: str) -> dict:
+    """Reads a result file into {(name, rows): result}"""
+    with open(path, encoding="utf-8") as source:
+        report = json.load(source)
+    return report["meta"], {(result["name"], result["rows"]): result for result in report["results"]}
+
+
+def compare(before: dict, after: dict, threshold: float) -> tuple:
+    """Returns the comparison lines and the number of regressions"""
+    lines = [f"{'benchmark':<52} {'rows':>8} {'before ms':>11} {'after ms':>11} {'change':>8}"]
+    regressions = 0
+    for key in sorted(before.keys() | after.keys(), key=lambda key: (key[1], key[0])):
+        old, new = before.get(key, {}), after.get(key, {})
+        if "median_ms" not in old or "median_ms" not in new:
+            status = old.get("error") or new.get("error") or "missing"
+            lines.append(f"{key[0]:<52} {key[1]:>8} {status}")
+            continue
+        change = (new["median_ms"] - old["median_ms"]) / old["median_ms"] * 100
+        flag = ""
+        if change > threshold:
+            flag = "  slower"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  faster"
+        lines.append(
+            f"{key[0]:<52} {key[1]:>8} {old['median_ms']:>11.3f} {new['median_ms']:>11.3f} {change:>+7.1f}%{flag}"
+        )
+    return lines, regressions
+
+
+def main(argv=None):
+    """Prints the comparison, exiting with 1 when a benchmark got slower than the threshold"""
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10, help="change in percent that counts (default: 10)")
+    args = parser.parse_args(argv)
+    before_meta, before = load(args.before)
+    after_meta, after = load(args.after)
+    print(f"before: {before_meta.get('commit')} ({before_meta.get('database')}, {before_meta.get('date')})")
+    print(f"after:  {after_meta.get('commit')} ({after_meta.get('database')}, {after_meta.get('date')})")
+    lines, regressions = compare(before, after, args.threshold)
+    print("\n".join(lines))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""
+Benchmark data
+
+Grows the products table with the deterministic rows of the db-seed command
+"""
+from sqlalchemy import func
+from service.common.seeding import seed_products
+
+
+def grow_table(session, model, rows: int, seed: int = 0) -> int:
+    """Adds generated rows to the table of a model until it holds at least the given number
+
+    :return: the number of rows added
+    :rtype: int
+
+    """
+    existing = session.scalar(func.count(model.id).select())  # pylint: disable=not-callable
+    missing = max(rows - existing, 0)
+    session.commit()
+    if missing:
+        seed_products(session.get_bind(), model.__table__, missing, seed + existing)
+    return missing
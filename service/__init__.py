@@ -8,13 +8,16 @@ import sys
 from flask import Flask
 from flask_restx import Api
 from service import config
-from service.common import log_handlers
+from service.common import log_handlers, compression, replicas, metrics
 
 # Create Flask application
 app = Flask(__name__)
 app.url_map.strict_slashes = False
 
 app.config.from_object(config)
+metrics.init_metrics(app)
+compression.init_compression(app)
+replicas.init_replicas(app)
 
 # app.config["SECRET_KEY"] = "secret-for-dev"
 # app.config["LOGGING_LEVEL"] = logging.INFO
@@ -0,0 +1,179 @@
+"""
+Cache
+
+This module contains the cache backends used in front of the database.
+Any object with the same get/set/delete/clear/stats methods as
+CacheBackend can be plugged in, e.g. one backed by a shared store.
+AggregateCache holds grouped totals that the writes keep current.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class CacheBackend:
+    """Interface of a key/value cache"""
+
+    def get(self, key):
+        """Returns the value cached for a key, or None"""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Caches a value for a key"""
+        raise NotImplementedError
+
+    def delete(self, *keys):
+        """Removes keys from the cache"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Removes every key from the cache"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Returns the counters of the cache"""
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+    """An in-process cache with least-recently-used and time-to-live eviction
+
+    Each worker process has its own copy, so entries written elsewhere can
+    be up to ``ttl`` seconds stale. A maxsize of 0 disables caching.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "lru",
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class AggregateCache:
+    """Counts and sums per group, kept current with the changes of each write
+
+    A grouping (e.g. by category) is loaded with one query the first time it
+    is read and then updated in place: every write calls apply() with the
+    group values of its row and what it adds to each total, negative to take
+    a row away. Each worker process has its own copy, so the writes of other
+    workers only show once a grouping is reloaded, after ``ttl`` seconds.
+    A ttl of 0 disables caching.
+    """
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._groupings = {}
+        # bumped by every write, so that a load that raced with one is not kept
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        """Take it before running the query of set()"""
+        return self._generation
+
+    def loaded(self) -> bool:
+        """Returns True if any grouping is cached"""
+        return bool(self._groupings)
+
+    def get(self, group_by: str):
+        """Returns a copy of the totals of a grouping by group value, or None"""
+        with self._lock:
+            entry = self._groupings.get(group_by)
+            if entry is None or entry[0] < time.monotonic():
+                self._groupings.pop(group_by, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return {key: list(totals) for key, totals in entry[1].items()}
+
+    def set(self, group_by: str, totals: dict, generation: int):
+        """Caches the totals of a grouping unless a write happened since generation was taken"""
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation == self._generation:
+                self._groupings[group_by] = (time.monotonic() + self.ttl, {key: list(value) for key, value in totals.items()})
+
+    def apply(self, groups: dict, deltas: tuple):
+        """Adds deltas to the totals of the groups a row belongs to
+
+        :param groups: the value of the row for each grouping, e.g. {"category": "books", ...}
+        :param deltas: what the write adds to each total, in the order of the totals
+
+        """
+        with self._lock:
+            self._generation += 1
+            for group_by, (_, totals) in self._groupings.items():
+                key = groups[group_by]
+                current = totals.setdefault(key, [0] * len(deltas))
+                for position, delta in enumerate(deltas):
+                    current[position] += delta
+                # the first total is the row count, a group without rows is gone
+                if current[0] <= 0:
+                    del totals[key]
+
+    def clear(self):
+        """Drops every grouping, e.g. after a bulk write"""
+        with self._lock:
+            self._generation += 1
+            self._groupings.clear()
+
+    def stats(self) -> dict:
+        """Returns the counters of the cache"""
+        with self._lock:
+            return {
+                "backend": "aggregate",
+                "groupings": sorted(self._groupings),
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -1,8 +1,19 @@
 """
 Flask CLI Command Extensions
 """
+import json
+import time
+import click
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
 from service import app
-from service.models import db
+from service.models import db, Product
+from service.common.compression import precompress_static
+from service.common.seeding import seed_products
+from service.common.importing import detect_format, import_products
+
+# Indexes that newer ones in Product.__table_args__ replace; db-index drops them
+RETIRED_INDEXES = ("ix_product_stock", "ix_product_create_date")
 
 
 ######################################################################
@@ -19,3 +30,180 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to add new columns to an existing database
+# Usage:
+#   flask db-migrate
+######################################################################
+@app.cli.command("db-migrate")
+def db_migrate():
+    """
+    Adds the Product columns that are missing from an existing table.
+    New columns must have a server default so existing rows get a value.
+    A stored generated column is computed for every row while the table is
+    rewritten under an ACCESS EXCLUSIVE lock, so run it in a maintenance window.
+    """
+    table = Product.__table__
+    existing = {column["name"] for column in inspect(db.engine).get_columns(table.name)}
+    with db.engine.begin() as conn:
+        disable_statement_timeout(conn, local=True)
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if column.computed is not None:
+                click.echo(f"Adding generated column {column.name}, the table is locked while it is rewritten")
+            ddl = CreateColumn(column).compile(dialect=db.engine.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+            click.echo(f"Added column {column.name}")
+    click.echo("Database is up to date")
+
+
+######################################################################
+# Command to build missing indexes on a live database
+# Usage:
+#   flask db-index
+######################################################################
+@app.cli.command("db-index")
+def db_index():
+    """
+    Creates any missing Product indexes, then drops the retired ones. On
+    PostgreSQL this runs CONCURRENTLY so writes are not locked out.
+    """
+    concurrently = db.engine.dialect.name == "postgresql"
+    # CONCURRENTLY cannot run inside a transaction block
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        disable_statement_timeout(conn)
+        for index in sorted(Product.__table__.indexes, key=lambda index: index.name):
+            if concurrently:
+                drop_invalid_index(conn, index.name)
+            create_index(conn, index, concurrently)
+            click.echo(f"Index {index.name} is ready")
+        # only once their replacements are ready
+        existing = {index["name"] for index in inspect(conn).get_indexes(Product.__table__.name)}
+        for name in RETIRED_INDEXES:
+            if name in existing:
+                conn.execute(text(f'DROP INDEX {"CONCURRENTLY " if concurrently else ""}IF EXISTS "{name}"'))
+                click.echo(f"Dropped retired index {name}")
+
+
+def disable_statement_timeout(conn, local: bool = False):
+    """Lifts DB_STATEMENT_TIMEOUT on a connection, for the transaction only if local
+
+    The timeout guards requests, but the DDL of a large table runs for
+    minutes, and a cancelled CREATE INDEX CONCURRENTLY leaves an INVALID index.
+    """
+    if db.engine.dialect.name == "postgresql":
+        conn.execute(text(f"SET {'LOCAL ' if local else ''}statement_timeout = 0"))
+
+
+def drop_invalid_index(conn, name: str):
+    """Drops an index left INVALID by an interrupted concurrent build"""
+    invalid = conn.execute(
+        text(
+            "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE c.relname = :name AND NOT i.indisvalid"
+        ),
+        {"name": name},
+    ).first()
+    if invalid:
+        click.echo(f"Dropping invalid index {name}")
+        conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}"'))
+
+
+def create_index(conn, index, concurrently: bool):
+    """Creates an index if it does not exist yet"""
+    options = index.dialect_options["postgresql"]
+    options["concurrently"] = concurrently
+    try:
+        conn.execute(CreateIndex(index, if_not_exists=True))
+    finally:
+        options["concurrently"] = False
+
+
+######################################################################
+# Command to load synthetic products for local load testing
+# Usage:
+#   flask db-seed --count 10000000 --seed 42
+######################################################################
+@app.cli.command("db-seed")
+@click.option("--count", default=1000, show_default=True, help="Number of products to add")
+@click.option("--seed", default=0, show_default=True, help="Seed of the generator, same seed same rows")
+@click.option("--batch-size", default=100000, show_default=True, help="Rows sent per COPY")
+def db_seed(count, seed, batch_size):
+    """
+    Adds realistic generated products with skewed category, price and
+    popularity distributions. On PostgreSQL they are loaded with COPY.
+    """
+    start = time.perf_counter()
+    seed_products(db.engine, Product.__table__, count, seed, batch_size)
+    elapsed = time.perf_counter() - start
+    click.echo(f"Added {count} products in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} rows/s)")
+
+
+######################################################################
+# Command to bulk load products from a supplier feed
+# Usage:
+#   flask products-import feed.csv --errors feed.rejected.ndjson
+######################################################################
+@app.cli.command("products-import")
+@click.argument("file", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), help="File format [default: from the extension]")
+@click.option("--errors", help="File for the rejected records [default: FILE.rejected.ndjson]")
+@click.option("--batch-size", default=10000, show_default=True, help="Rows sent per COPY")
+def products_import(file, fmt, errors, batch_size):
+    """
+    Loads the products of a CSV file (with a header row) or an NDJSON
+    file. Every record is validated like a posted product; rejected ones
+    are written to the errors file as NDJSON with their line and reason.
+    """
+    fmt = fmt or detect_format(file)
+    if not fmt:
+        raise click.UsageError("Cannot tell the format from the file name, use --format")
+    errors = errors or f"{file}.rejected.ndjson"
+    with open(file, encoding="utf-8-sig", newline="") as lines, RejectWriter(errors) as reject:
+        start = time.perf_counter()
+        counts = import_products(lines, fmt, reject, batch_size)
+        elapsed = time.perf_counter() - start
+    imported = counts["imported"]
+    click.echo(f"Imported {imported} products in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):.0f} rows/s)")
+    if counts["rejected"]:
+        click.echo(f"Rejected {counts['rejected']} records, see {errors}")
+
+
+class RejectWriter:
+    """Writes rejected records as NDJSON, creating the file on the first one"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def __call__(self, line, record, error):
+        if self.file is None:
+            self.file = open(self.path, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+        self.file.write(json.dumps({"line": line, "error": error, "record": record}) + "\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.file is not None:
+            self.file.close()
+
+
+######################################################################
+# Command to precompress the static assets
+# Usage:
+#   flask static-compress
+######################################################################
+@app.cli.command("static-compress")
+def static_compress():
+    """
+    Writes gzip and brotli copies of the static assets next to them so
+    they can be served without compressing them on every request
+    """
+    written = precompress_static(app.static_folder, app.config["COMPRESS_MIMETYPES"], app.config["COMPRESS_MIN_SIZE"])
+    for path in written:
+        click.echo(f"Wrote {path}")
+    click.echo(f"{len(written)} files compressed")
@@ -0,0 +1,122 @@
+"""
+Compression
+
+This module contains functions to negotiate gzip/brotli compression of
+responses and to serve static assets that were compressed ahead of time
+"""
+import os
+import re
+import gzip
+import mimetypes
+import brotli
+from flask import current_app, request, send_from_directory
+
+# Content codings we can produce, in order of preference
+ENCODINGS = ("br", "gzip")
+
+# File suffix of each precompressed static asset
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Static files named like app.3f2a9c1b.js never change, so they can be cached forever
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{8,}\.[a-z0-9]+$")
+
+
+def init_compression(app):
+    """Compresses eligible responses and serves precompressed static files"""
+    app.after_request(compress_response)
+
+    def static(filename):
+        return send_static(app, filename)
+
+    app.view_functions["static"] = static
+
+
+def choose_encoding(encodings=ENCODINGS):
+    """Returns the best encoding the client accepts, or None"""
+    return request.accept_encodings.best_match(encodings)
+
+
+def compress(data: bytes, encoding: str, level: int) -> bytes:
+    """Compresses data with gzip (level 1-9) or brotli (quality 0-11)"""
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_response(response):
+    """Compresses a response body that is big enough and of a compressible type"""
+    config = current_app.config
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in config["COMPRESS_MIMETYPES"]
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < config["COMPRESS_MIN_SIZE"]:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding()
+    if not encoding:
+        return response
+    level = config["COMPRESS_BROTLI_QUALITY"] if encoding == "br" else config["COMPRESS_GZIP_LEVEL"]
+    response.set_data(compress(data, encoding, level))
+    response.headers["Content-Encoding"] = encoding
+    # a strong ETag must differ between encodings of the same resource
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+def send_static(app, filename: str):
+    """Sends a static file, using a precompressed copy if the client accepts one"""
+    available = [
+        encoding for encoding in ENCODINGS
+        if os.path.isfile(os.path.join(app.static_folder, filename + SUFFIXES[encoding]))
+    ]
+    encoding = choose_encoding(available) if available else None
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    if encoding:
+        response = send_from_directory(app.static_folder, filename + SUFFIXES[encoding], mimetype=mimetype)
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = send_from_directory(app.static_folder, filename, mimetype=mimetype)
+    if available:
+        response.vary.add("Accept-Encoding")
+    if FINGERPRINTED.search(filename):
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config["STATIC_IMMUTABLE_MAX_AGE"]
+        response.cache_control.immutable = True
+    return response
+
+
+def precompress_static(folder: str, mimetypes_allowed, min_size: int) -> list:
+    """Writes .gz and .br copies of the compressible files in a folder
+
+    :return: the paths of the files written
+    :rtype: list
+
+    """
+    written = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if name.endswith(tuple(SUFFIXES.values())) or os.path.getsize(path) < min_size:
+                continue
+            if mimetypes.guess_type(name)[0] not in mimetypes_allowed:
+                continue
+            with open(path, "rb") as source:
+                data = source.read()
+            for encoding, suffix in SUFFIXES.items():
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                level = 11 if encoding == "br" else 9
+                with open(target, "wb") as output:
+                    output.write(compress(data, encoding, level))
+                written.append(target)
+    return written
@@ -0,0 +1,51 @@
+"""
+Copying
+
+This module holds the bulk loading steps shared by the seeder and the
+importer. Rows are sent in batches: on PostgreSQL with COPY in text format
+through a psycopg2 cursor, elsewhere with multi-row INSERTs.
+"""
+import io
+import itertools
+from sqlalchemy import insert, text
+
+# Escapes of the COPY text format
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def batched(rows, size: int):
+    """Returns an iterator over lists of up to size rows, read lazily from rows"""
+    rows = iter(rows)
+    return iter(lambda: list(itertools.islice(rows, size)), [])
+
+
+def copy_line(row) -> str:
+    """Formats a row for COPY in text format, escaping the values"""
+    return "\t".join(
+        "\\N" if value is None
+        else ("t" if value else "f") if isinstance(value, bool)
+        else str(value).translate(COPY_ESCAPES)
+        for value in row
+    ) + "\n"
+
+
+def copy_rows(cursor, table_name: str, columns, rows, batch_size: int):
+    """Streams rows of columns values into a table with one COPY per batch"""
+    names = ", ".join(f'"{name}"' for name in columns)
+    sql = f'COPY "{table_name}" ({names}) FROM STDIN'
+    for batch in batched(rows, batch_size):
+        cursor.copy_expert(sql, io.StringIO("".join(copy_line(row) for row in batch)))
+
+
+def insert_rows(conn, table, columns, rows, batch_size: int):
+    """Adds rows of columns values to a table with one multi-row INSERT per batch"""
+    for batch in batched(rows, batch_size):
+        conn.execute(insert(table), [dict(zip(columns, row)) for row in batch])
+
+
+def analyze(engine, table_name: str):
+    """Refreshes the statistics of a table, so the planner knows about the rows just loaded at once"""
+    with engine.begin() as conn:
+        # ANALYZE of a large table can outlast the statement_timeout of requests
+        conn.execute(text("SET LOCAL statement_timeout = 0"))
+        conn.execute(text(f'ANALYZE "{table_name}"'))
@@ -19,7 +19,8 @@ Module: error_handlers
 """
 from flask import jsonify
 from service.models import DataValidationError
-from service import app
+from service.common.resilience import DatabaseUnavailableError
+from service import app, api
 from . import status
 
 
@@ -101,6 +102,45 @@ def mediatype_not_supported(error):
     )
 
 
+@app.errorhandler(DatabaseUnavailableError)
+def database_unavailable(error):
+    """Handles an unreachable database with 503_SERVICE_UNAVAILABLE"""
+    body, code, headers = api_database_unavailable(error)
+    return jsonify(body), code, headers
+
+
+# flask-restx answers the errors of its resources itself unless it has a handler
+@api.errorhandler(DatabaseUnavailableError)
+def api_database_unavailable(error):
+    """Handles an unreachable database in the API with 503_SERVICE_UNAVAILABLE"""
+    message = str(error)
+    app.logger.error(message)
+    return (
+        {
+            "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "error": "Service Unavailable",
+            "message": message,
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE,
+        {"Retry-After": str(int(error.retry_after + 0.5))},
+    )
+
+
+@api.errorhandler(DataValidationError)
+def api_request_validation_error(error):
+    """Handles Value Errors from bad data in the API with 400_BAD_REQUEST"""
+    message = str(error)
+    app.logger.warning(message)
+    return (
+        {
+            "status": status.HTTP_400_BAD_REQUEST,
+            "error": "Bad Request",
+            "message": message,
+        },
+        status.HTTP_400_BAD_REQUEST,
+    )
+
+
 @app.errorhandler(status.HTTP_500_INTERNAL_SERVER_ERROR)
 def internal_server_error(error):
     """Handles unexpected server error with 500_SERVER_ERROR"""
@@ -0,0 +1,174 @@
+"""
+Importing
+
+This module bulk loads products from CSV or NDJSON files. The file is read
+one line at a time and every record is checked with the same rules as
+Product.deserialize, so memory use does not grow with the file. Rejected
+records are handed to a callback with their line number and the reason.
+On PostgreSQL the valid rows are streamed with COPY into a temporary staging
+table and moved to the products table with a single INSERT ... SELECT, so
+an import either adds all of its valid rows or none of them.
+"""
+import csv
+import json
+import math
+from types import SimpleNamespace
+from flask_restx import inputs
+from service.models import db, retry, Product, DataValidationError
+from service.common.copying import analyze, copy_rows, insert_rows
+
+# File formats, by file extension and by Content-Type
+EXTENSIONS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+MIMETYPES = {"text/csv": "csv", "application/x-ndjson": "ndjson", "application/jsonl": "ndjson"}
+
+# Columns loaded from each record, in COPY order; the others take their defaults
+COLUMNS = Product.UPDATABLE
+CHECKED_COLUMNS = [Product.__table__.columns[name] for name in COLUMNS]
+
+# Temporary table the rows are copied to before they reach the products table
+STAGING_TABLE = "product_import"
+
+# CSV cells are text, these columns are converted before validation
+CSV_TYPES = {"price": float, "stock": int, "likes": int, "available": inputs.boolean}
+
+
+def detect_format(name: str, mimetypes: bool = False) -> str:
+    """Returns csv or ndjson for a file name or a Content-Type, None if it is neither"""
+    if mimetypes:
+        return MIMETYPES.get((name or "").split(";")[0].strip().lower())
+    return next((fmt for ext, fmt in EXTENSIONS.items() if (name or "").lower().endswith(ext)), None)
+
+
+def read_records(lines, fmt: str):
+    """Yields (line number, raw record) for an iterable of text lines
+
+    CSV records are dicts of strings keyed by the header row, NDJSON
+    records are the text of their line. Blank lines are skipped.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                yield number, line.rstrip("\r\n")
+
+
+def product_row(record, fmt: str) -> tuple:
+    """Validates a raw record and returns its COLUMNS values
+
+    :param record: a raw record from read_records()
+    :param fmt: csv or ndjson
+
+    :return: the values to load
+    :rtype: tuple
+
+    """
+    if fmt == "csv":
+        data = csv_data(record)
+    else:
+        try:
+            data = json.loads(record)
+        except ValueError as error:
+            raise DataValidationError(f"Invalid JSON: {error}") from error
+        if not isinstance(data, dict):
+            raise DataValidationError("Invalid Product: a record must be a JSON object")
+    # the rules of Product.deserialize, applied to a plain object to skip the ORM instrumentation
+    product = Product.deserialize(SimpleNamespace(desc=None), data)
+    values = tuple(getattr(product, name) for name in COLUMNS)
+    for column, value in zip(CHECKED_COLUMNS, values):
+        check_value(column, value)
+    return values
+
+
+def csv_data(record: dict) -> dict:
+    """Converts the text cells of a CSV record to the types of a posted product"""
+    if None in record or None in record.values():
+        raise DataValidationError("Invalid Product: wrong number of fields")
+    data = dict(record)
+    try:
+        for name, convert in CSV_TYPES.items():
+            if name in data:
+                data[name] = convert(data[name])
+    except ValueError as error:
+        raise DataValidationError(f"Invalid Product: {name}: {error}") from error
+    return data
+
+
+def check_value(column, value):
+    """Raises DataValidationError for a value the column would refuse, so that no COPY ever fails"""
+    python_type = column.type.python_type
+    if value is None:
+        if column.nullable:
+            return
+        raise DataValidationError(f"Invalid Product: {column.name} cannot be null")
+    if python_type is float:
+        valid = isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+    elif python_type is int:
+        valid = isinstance(value, int) and not isinstance(value, bool) and -2**31 <= value < 2**31
+    else:
+        valid = isinstance(value, python_type)
+    if not valid:
+        raise DataValidationError(f"Invalid Product: {column.name} must be a valid {python_type.__name__}")
+    if python_type is str:
+        if len(value) > (column.type.length or len(value)):
+            raise DataValidationError(f"Invalid Product: {column.name} is longer than {column.type.length}")
+        if "\x00" in value:
+            raise DataValidationError(f"Invalid Product: {column.name} contains a NUL character")
+
+
+def valid_rows(lines, fmt: str, counts: dict, on_reject=None):
+    """Yields the values of the valid records and counts them, passing the others to on_reject(line, record, error)"""
+    for number, record in read_records(lines, fmt):
+        try:
+            yield product_row(record, fmt)
+        except DataValidationError as error:
+            counts["rejected"] += 1
+            if on_reject:
+                on_reject(number, record, str(error))
+        else:
+            counts["imported"] += 1
+
+
+@retry(tries=1)
+def import_products(lines, fmt: str, on_reject=None, batch_size: int = 10000) -> dict:
+    """Loads the valid records of a CSV or NDJSON file into the products table in one transaction
+
+    :param lines: an iterable of text lines, e.g. an open file
+    :param fmt: csv or ndjson
+    :param on_reject: called with the line number, raw record and error of each rejected record
+    :param batch_size: the rows sent per COPY or INSERT
+
+    :return: the number of products imported and of records rejected
+    :rtype: dict
+
+    """
+    counts = {"imported": 0, "rejected": 0}
+    rows = valid_rows(lines, fmt, counts, on_reject)
+    engine = db.engine
+    table = Product.__table__
+    if engine.dialect.name == "postgresql":
+        columns = ", ".join(f'"{name}"' for name in COLUMNS)
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                # one INSERT ... SELECT moves every row, for as long as that takes
+                cursor.execute("SET LOCAL statement_timeout = 0")
+                cursor.execute(
+                    f'CREATE TEMPORARY TABLE "{STAGING_TABLE}" ON COMMIT DROP AS '
+                    f'SELECT {columns} FROM "{table.name}" WITH NO DATA'
+                )
+                copy_rows(cursor, STAGING_TABLE, COLUMNS, rows, batch_size)
+                cursor.execute(f'INSERT INTO "{table.name}" ({columns}) SELECT {columns} FROM "{STAGING_TABLE}"')
+            connection.commit()
+        finally:
+            connection.close()
+        if counts["imported"]:
+            analyze(engine, table.name)
+    else:
+        with engine.begin() as conn:
+            insert_rows(conn, table, COLUMNS, rows, batch_size)
+    if counts["imported"]:
+        Product.totals.clear()
+    return counts
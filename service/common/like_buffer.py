@@ -0,0 +1,96 @@
+"""
+Like Buffer
+
+This module contains a write-behind buffer that aggregates like
+increments in memory and writes them to the database in batches
+"""
+import atexit
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger("flask.app")
+
+
+class LikeBuffer:
+    """Buffers like increments per product and flushes them periodically
+
+    Each worker process keeps its own buffer. Pending likes are written by
+    a background thread at most ``interval`` seconds after they were added,
+    as soon as ``max_pending`` likes are waiting, and when the process exits.
+    """
+
+    def __init__(self, flush_function, interval: float = 1.0, max_pending: int = 1000):
+        """
+        Args:
+            flush_function (callable): writes a dict of {product_id: increment}
+            interval (float): the maximum number of seconds a like stays buffered
+            max_pending (int): the number of pending likes that triggers an early flush
+        """
+        if interval <= 0:
+            raise ValueError("interval must be positive")
+        self.interval = interval
+        self.max_pending = max_pending
+        self._flush_function = flush_function
+        self._pending = Counter()
+        self._flushing = Counter()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, product_id: int, count: int = 1):
+        """Buffers likes for a product"""
+        with self._lock:
+            self._pending[product_id] += count
+            full = sum(self._pending.values()) >= self.max_pending
+            if self._thread is None:
+                self._start()
+        if full:
+            self._wakeup.set()
+
+    def pending(self, product_id: int) -> int:
+        """Returns the likes of a product that are not in the database yet"""
+        with self._lock:
+            return self._pending[product_id] + self._flushing[product_id]
+
+    def flush(self):
+        """Writes all pending likes to the database"""
+        with self._flush_lock:
+            with self._lock:
+                counts, self._pending = self._pending, Counter()
+                self._flushing = counts
+            if not counts:
+                return
+            try:
+                self._flush_function(dict(counts))
+                logger.debug("Flushed likes for %s products", len(counts))
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Could not flush likes, keeping them for the next flush")
+                with self._lock:
+                    self._pending.update(counts)
+            finally:
+                with self._lock:
+                    self._flushing = Counter()
+
+    def close(self):
+        """Stops the background thread and flushes what is left"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _start(self):
+        """Starts the flush thread on first use, i.e. inside the worker process"""
+        self._thread = threading.Thread(target=self._run, name="like-buffer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        """Flushes the buffer every interval until the buffer is closed"""
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
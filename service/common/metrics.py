@@ -0,0 +1,106 @@
+"""
+Metrics
+
+This module exposes Prometheus metrics at /metrics: request latency and
+response size per resource method (e.g. ProductResource.get), requests in
+flight, and the number of SQL queries and the time spent in the database
+per request as counted by the SQL accounting of the models. Set
+PROMETHEUS_MULTIPROC_DIR to aggregate the gunicorn workers.
+"""
+import os
+import time
+from flask import Response, current_app, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency", ["endpoint"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUEST_COUNT = Counter("http_requests_total", "Requests answered", ["endpoint", "status"])
+REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being handled", multiprocess_mode="livesum")
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Size of the response bodies", ["endpoint"],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+)
+DB_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements executed per request", ["endpoint"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+DB_TIME = Histogram(
+    "db_time_per_request_seconds", "Time spent executing SQL per request", ["endpoint"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+# label of each (endpoint, method) pair, e.g. ("productresource", "GET") -> "ProductResource.get"
+_labels = {}
+
+
+def init_metrics(app):
+    """Measures every request and serves the metrics at /metrics
+
+    Call it before the other extensions that change the response, so that
+    the sizes measured are the ones sent.
+    """
+    app.before_request(start_request)
+    app.after_request(record_response)
+    app.teardown_request(end_request)
+    app.add_url_rule("/metrics", "metrics", metrics)
+
+
+def endpoint_label() -> str:
+    """Returns the resource method handling the request, or the endpoint of plain routes"""
+    key = (request.endpoint, request.method)
+    label = _labels.get(key)
+    if label is None:
+        view = current_app.view_functions.get(request.endpoint)
+        view_class = getattr(view, "view_class", None)
+        if view_class is not None:
+            label = f"{view_class.__name__}.{request.method.lower()}"
+        else:
+            label = request.endpoint or "unmatched"
+        _labels[key] = label
+    return label
+
+
+def start_request():
+    """Starts the clock of a request"""
+    g.metrics_start = time.perf_counter()
+    REQUESTS_IN_PROGRESS.inc()
+
+
+def record_response(response):
+    """Records the latency, size and SQL work of a request"""
+    if "metrics_start" not in g:
+        return response
+    label = endpoint_label()
+    REQUEST_LATENCY.labels(label).observe(time.perf_counter() - g.metrics_start)
+    REQUEST_COUNT.labels(label, response.status_code).inc()
+    if response.content_length is not None:
+        RESPONSE_SIZE.labels(label).observe(response.content_length)
+    DB_QUERIES.labels(label).observe(g.get("db_queries", 0))
+    DB_TIME.labels(label).observe(g.get("db_time", 0.0))
+    return response
+
+
+def end_request(exception=None):  # pylint: disable=unused-argument
+    """Counts the request out of the ones in progress, even when it failed"""
+    if g.pop("metrics_start", None) is not None:
+        REQUESTS_IN_PROGRESS.dec()
+
+
+def metrics():
+    """Prometheus metrics of this process, or of all the workers in multiprocess mode"""
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
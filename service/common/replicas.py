@@ -0,0 +1,77 @@
+"""
+Replicas
+
+This module routes the reads of safe requests (GET, HEAD) to read replicas
+configured as SQLAlchemy binds named replica0, replica1, ... Writes, and
+every query of a client that wrote within READ_YOUR_WRITES_WINDOW seconds,
+go to the primary so that clients always see their own changes.
+"""
+import time
+import random
+from flask import g, request, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select
+
+# Bind keys of the replicas are this prefix followed by a number
+REPLICA_PREFIX = "replica"
+
+# Cookie holding the time until which a client that wrote reads from the primary
+PRIMARY_COOKIE = "db_primary_until"
+
+# Requests that never write, whose reads may be served by a replica
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+def replica_binds(uris: str, engine_options: dict = None) -> dict:
+    """Returns SQLALCHEMY_BINDS entries for a comma separated list of replica URIs
+
+    Binds do not inherit SQLALCHEMY_ENGINE_OPTIONS, so they are copied into each entry.
+    """
+    uris = [uri.strip() for uri in (uris or "").split(",") if uri.strip()]
+    return {f"{REPLICA_PREFIX}{position}": {**(engine_options or {}), "url": uri} for position, uri in enumerate(uris)}
+
+
+class RoutingSession(Session):
+    """A Session that sends the SELECTs of the current request to its replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and isinstance(clause, Select) and has_request_context():
+            key = g.get("db_replica")
+            if key:
+                return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def pinned_to_primary() -> bool:
+    """Returns True while the current request reads from the primary because its client wrote recently
+
+    Such a request must not be answered from data cached out of a replica either.
+    """
+    return has_request_context() and g.get("db_primary", False)
+
+
+def init_replicas(app):
+    """Picks a replica for each safe request and pins clients that wrote to the primary"""
+    keys = sorted(key for key in app.config.get("SQLALCHEMY_BINDS") or {} if key.startswith(REPLICA_PREFIX))
+    if not keys:
+        return
+    window = app.config["READ_YOUR_WRITES_WINDOW"]
+
+    @app.before_request
+    def choose_replica():
+        if request.method not in SAFE_METHODS:
+            return
+        try:
+            primary_until = float(request.cookies.get(PRIMARY_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        if primary_until < time.time():
+            g.db_replica = random.choice(keys)
+        else:
+            g.db_primary = True
+
+    @app.after_request
+    def pin_to_primary(response):
+        if request.method not in SAFE_METHODS and response.status_code < 400 and window > 0:
+            response.set_cookie(PRIMARY_COOKIE, f"{time.time() + window:.3f}", max_age=window, httponly=True)
+        return response
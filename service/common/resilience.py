@@ -0,0 +1,168 @@
+"""
+Resilience
+
+This module contains the retry policy for transient database errors and
+the circuit breaker that fails requests fast while the database is down.
+Retries back off exponentially with full jitter and stop when they run
+out of tries or of their time budget, whichever comes first.
+"""
+import time
+import random
+import logging
+import threading
+import functools
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+# SQLSTATE of statements cancelled by statement_timeout, which must not be retried
+QUERY_CANCELED = "57014"
+
+# nested calls run inside the retry loop of the outermost one
+_local = threading.local()
+
+
+class DatabaseUnavailableError(Exception):
+    """Used when the database cannot be reached or the circuit breaker is open"""
+
+    def __init__(self, message: str, retry_after: float = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_transient(error: Exception) -> bool:
+    """Returns True for errors that a new attempt may not run into: disconnects, failovers, deadlocks"""
+    if not isinstance(error, DBAPIError):
+        return False
+    if error.connection_invalidated:
+        return True
+    return isinstance(error, OperationalError) and getattr(error.orig, "pgcode", None) != QUERY_CANCELED
+
+
+class CircuitBreaker:
+    """Stops calls to the database after repeated transient failures
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail at once. After reset_timeout seconds one trial call is let through:
+    success closes the circuit again, failure keeps it open.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._rejected = 0
+
+    @property
+    def state(self) -> str:
+        """Returns closed, open or half_open"""
+        return self._state
+
+    def before_call(self):
+        """Raises DatabaseUnavailableError unless a call may go ahead"""
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self._state == self.OPEN and remaining <= 0:
+                self._state = self.HALF_OPEN
+                return
+            self._rejected += 1
+        raise DatabaseUnavailableError("Database unavailable: circuit breaker is open", max(remaining, 1))
+
+    def record_success(self):
+        """Closes the circuit after a call that reached the database"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        """Counts a transient failure, opening the circuit at the threshold"""
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def reset(self):
+        """Closes the circuit and clears the counters"""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._rejected = 0
+
+    def stats(self) -> dict:
+        """Returns the state and counters of the circuit"""
+        with self._lock:
+            return {"state": self._state, "failures": self._failures, "rejected": self._rejected}
+
+
+def _record_failure(breaker: CircuitBreaker, error: Exception, cleanup=None):
+    """Counts a failed call on the breaker, re-raising the errors that are not transient"""
+    if not is_transient(error):
+        # the database answered, so the circuit is fine
+        breaker.record_success()
+        raise error
+    breaker.record_failure()
+    if cleanup:
+        cleanup()
+
+
+def _backoff(attempt: int, delay: float, max_delay: float) -> float:
+    """Returns the pause before a retry, full jitter: anywhere between 0 and the exponential backoff"""
+    return random.uniform(0, min(max_delay, delay * 2 ** attempt))
+
+
+def retry_transient(breaker: CircuitBreaker, tries: int = 3, delay: float = 0.1, max_delay: float = 2.0,
+                    budget: float = 5.0, cleanup=None, logger=None):
+    """Decorator retrying a function on transient database errors
+
+    :param breaker: the circuit breaker guarding the database
+    :param tries: the maximum number of attempts (1 only guards the call with the breaker)
+    :param delay: the base of the exponential backoff, in seconds
+    :param max_delay: the longest wait between two attempts, in seconds
+    :param budget: the total time after which no new attempt is started, in seconds
+    :param cleanup: called after each failure, e.g. to roll back the session
+    :param logger: where to log the retries
+
+    """
+    logger = logger or logging.getLogger(__name__)
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "active", False):
+                return function(*args, **kwargs)
+            _local.active = True
+            try:
+                return _call(function, args, kwargs)
+            finally:
+                _local.active = False
+
+        def _call(function, args, kwargs):
+            deadline = time.monotonic() + budget
+            attempt = 0
+            while True:
+                breaker.before_call()
+                try:
+                    result = function(*args, **kwargs)
+                except Exception as error:  # pylint: disable=broad-except
+                    _record_failure(breaker, error, cleanup)
+                    attempt += 1
+                    pause = _backoff(attempt, delay, max_delay)
+                    if attempt >= tries or breaker.state != breaker.CLOSED or time.monotonic() + pause > deadline:
+                        raise DatabaseUnavailableError(f"Database unavailable: {error.orig}") from error
+                    logger.warning("%s failed (%s), retry %s in %.2fs", function.__name__, error.orig, attempt, pause)
+                    time.sleep(pause)
+                else:
+                    breaker.record_success()
+                    return result
+
+        return wrapper
+
+    return decorator
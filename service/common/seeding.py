@@ -0,0 +1,98 @@
+"""
+Seeding
+
+This module generates realistic synthetic products in bulk: a few categories
+hold most of the catalog, prices are log-normal around a per-category level,
+many products are out of stock, likes follow a long tail and most products
+were created recently. The same seed and day always give the same rows.
+On PostgreSQL the rows are streamed with COPY, elsewhere with multi-row INSERTs.
+"""
+import math
+import random
+import bisect
+import itertools
+from datetime import date, timedelta
+from service.common.copying import analyze, copy_rows, insert_rows
+
+# Columns written by the seeder, in COPY order; the others take their defaults
+COLUMNS = ("name", "price", "desc", "category", "stock", "create_date", "available", "likes")
+
+CATEGORIES = (
+    "electronics", "books", "clothing", "home", "toys", "sports", "beauty", "grocery",
+    "garden", "automotive", "health", "jewelry", "music", "office", "pets", "shoes",
+    "tools", "baby", "movies", "games", "crafts", "outdoors", "kitchen", "software",
+)
+ADJECTIVES = (
+    "red", "blue", "small", "large", "classic", "deluxe", "eco", "smart", "vintage", "compact",
+    "wireless", "premium", "basic", "portable", "organic", "heavy", "light", "pro", "mini", "ultra",
+)
+NOUNS = (
+    "lamp", "chair", "phone", "novel", "shirt", "ball", "mug", "drill", "kettle", "camera",
+    "speaker", "jacket", "puzzle", "brush", "watch", "bottle", "helmet", "guitar", "desk", "tent",
+)
+WORDS = ADJECTIVES + NOUNS + (
+    "with", "for", "and", "the", "every", "day", "made", "from", "quality", "materials", "easy",
+    "to", "use", "great", "gift", "fits", "most", "homes", "long", "lasting", "design",
+)
+
+# Category popularity follows Zipf's law with this exponent
+CATEGORY_SKEW = 1.1
+# Share of products with no stock left
+OUT_OF_STOCK = 0.15
+# Catalog age: mean and maximum age of a product in days
+MEAN_AGE = 365
+MAX_AGE = 3650
+
+
+def generate_products(count: int, seed: int = 0, today: date = None):
+    """Yields count rows of COLUMNS values with skewed distributions"""
+    rng = random.Random(seed)
+    today = today or date.today()
+    cum_weights = list(itertools.accumulate(1 / rank ** CATEGORY_SKEW for rank in range(1, len(CATEGORIES) + 1)))
+    total = cum_weights[-1]
+    # log of the median price of each category, from about 5 to 400
+    price_levels = [rng.uniform(math.log(5), math.log(400)) for _ in CATEGORIES]
+    for _ in range(count):
+        category = bisect.bisect(cum_weights, rng.random() * total)
+        price = round(min(math.exp(rng.gauss(price_levels[category], 0.8)), 99999.0), 2)
+        stock = 0 if rng.random() < OUT_OF_STOCK else int(rng.expovariate(1 / 40)) + 1
+        age = min(int(rng.expovariate(1 / MEAN_AGE)), MAX_AGE)
+        yield (
+            f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.randrange(10000)}",
+            price,
+            " ".join(rng.choices(WORDS, k=rng.randrange(31)))[:256],
+            CATEGORIES[category],
+            stock,
+            today - timedelta(days=age),
+            stock > 0 and rng.random() > 0.05,
+            min(int(rng.paretovariate(1.2)) - 1, 1000000),
+        )
+
+
+def seed_products(engine, table, count: int, seed: int = 0, batch_size: int = 100000) -> int:
+    """Adds count generated products to a table in one transaction
+
+    :param engine: the engine of the database to load
+    :param table: the products table
+    :param count: the number of products to add
+    :param seed: the seed of the generator
+    :param batch_size: the rows sent per COPY or INSERT
+
+    :return: the number of products added
+    :rtype: int
+
+    """
+    rows = generate_products(count, seed)
+    if engine.dialect.name == "postgresql":
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                copy_rows(cursor, table.name, COLUMNS, rows, batch_size)
+            connection.commit()
+        finally:
+            connection.close()
+        analyze(engine, table.name)
+    else:
+        with engine.begin() as conn:
+            insert_rows(conn, table, COLUMNS, rows, batch_size)
+    return count
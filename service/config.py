@@ -2,6 +2,8 @@
 Global Configuration for Application
 """
 import os
+from service.common.pooling import TimedQueuePool
+from service.common.replicas import replica_binds
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -12,5 +14,89 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Connection pool of each worker: at most DB_POOL_SIZE + DB_MAX_OVERFLOW connections,
+# so size them so that workers x replicas stays under the server's max_connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("true", "1", "yes")
+# Milliseconds a statement may run before the server cancels it (0 disables)
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", "30000"))
+
+SQLALCHEMY_ENGINE_OPTIONS = {}
+if DATABASE_URI.startswith("postgres"):
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "poolclass": TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "connect_args": {"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"},
+    }
+
+# SQL accounting: statements slower than SLOW_QUERY_THRESHOLD seconds are logged with
+# their parameters (0 disables), and a request running one statement N_PLUS_ONE_THRESHOLD
+# times or more is logged as a likely N+1 (0 disables)
+SLOW_QUERY_THRESHOLD = float(os.getenv("SLOW_QUERY_THRESHOLD", "0.5"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+# Read replicas: comma separated URIs, the reads of GET requests go to one of them
+DATABASE_REPLICA_URI = os.getenv("DATABASE_REPLICA_URI", "")
+SQLALCHEMY_BINDS = replica_binds(DATABASE_REPLICA_URI, SQLALCHEMY_ENGINE_OPTIONS)
+# Seconds during which a client that wrote keeps reading from the primary
+READ_YOUR_WRITES_WINDOW = int(os.getenv("READ_YOUR_WRITES_WINDOW", "5"))
+
+# Keyset pagination for list endpoints
+PAGE_LIMIT_DEFAULT = int(os.getenv("PAGE_LIMIT_DEFAULT", "100"))
+PAGE_LIMIT_MAX = int(os.getenv("PAGE_LIMIT_MAX", "1000"))
+
+# Full-text search: milliseconds before PostgreSQL cancels a search (0 disables)
+SEARCH_TIMEOUT = int(os.getenv("SEARCH_TIMEOUT", "1000"))
+
+# X-Total-Count of lists: exact (a COUNT) or estimated (the planner's statistics), unless the request picks one
+TOTAL_COUNT_MODE = os.getenv("TOTAL_COUNT_MODE", "estimated")
+
+# Rows fetched per round trip by the streaming export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+# Bulk create: maximum items per request and rows per INSERT/transaction
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+BATCH_INSERT_SIZE = int(os.getenv("BATCH_INSERT_SIZE", "1000"))
+
+# Bulk import: rows per COPY/INSERT and rejected records listed in an upload response
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "10000"))
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "100"))
+
+# Write-behind likes: seconds between flushes and pending likes that force one
+LIKE_FLUSH_INTERVAL = float(os.getenv("LIKE_FLUSH_INTERVAL", "1.0"))
+LIKE_FLUSH_MAX = int(os.getenv("LIKE_FLUSH_MAX", "1000"))
+
+# Read-through cache for single products (size 0 disables it)
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "1024"))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", "30"))
+
+# Cached product stats: seconds before a worker reloads totals it keeps current itself (0 disables)
+PRODUCT_STATS_TTL = float(os.getenv("PRODUCT_STATS_TTL", "60"))
+
+# Response compression: bodies smaller than COMPRESS_MIN_SIZE bytes are sent as is
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "4"))
+COMPRESS_MIMETYPES = {
+    "application/json",
+    "text/html",
+    "text/css",
+    "text/javascript",
+    "application/javascript",
+}
+
+# Cache lifetime of fingerprinted static files, e.g. app.3f2a9c1b.js
+STATIC_IMMUTABLE_MAX_AGE = int(os.getenv("STATIC_IMMUTABLE_MAX_AGE", "31536000"))
+
+# Serialize list responses straight from rows with the compiled serializer
+FAST_JSON = os.getenv("FAST_JSON", "true").lower() in ("true", "1", "yes")
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
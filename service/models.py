@@ -3,23 +3,56 @@ Models for Product
 
 All of the models are stored in this module
 """
+# pylint: disable=too-many-lines
 import os
+import json
+import base64
+import time
 import logging
+import operator
+import itertools
 from datetime import date
-from retry import retry
+import functools
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event, inspect, tuple_, text, select, update, bindparam, func, cast, and_, or_, literal
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement
+from sqlalchemy.exc import DBAPIError
 # from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from requests import HTTPError
+from service.common.cache import LRUCache, AggregateCache
+from service.common.resilience import CircuitBreaker, retry_transient
+from service.common.replicas import RoutingSession, pinned_to_primary
 # from requests import ConnectionError
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
-# global variables for retry (must be int)
-RETRY_COUNT = int(os.environ.get("RETRY_COUNT", 10))
-RETRY_DELAY = int(os.environ.get("RETRY_DELAY", 1))
-RETRY_BACKOFF = int(os.environ.get("RETRY_BACKOFF", 2))
+# global variables for retry of transient database errors (delays in seconds)
+RETRY_COUNT = int(os.environ.get("RETRY_COUNT", 3))
+RETRY_DELAY = float(os.environ.get("RETRY_DELAY", 0.1))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", 2))
+RETRY_BUDGET = float(os.environ.get("RETRY_BUDGET", 5))
+
+# circuit breaker: consecutive failures that open it and seconds before a trial call
+CIRCUIT_FAILURES = int(os.environ.get("CIRCUIT_FAILURES", 5))
+CIRCUIT_RESET = float(os.environ.get("CIRCUIT_RESET", 30))
+circuit_breaker = CircuitBreaker(CIRCUIT_FAILURES, CIRCUIT_RESET)
+
+# Only reads and deletes are safe to repeat: a write whose commit was lost may
+# have been applied, and a rollback expires the changes of an updated instance.
+# Other writes use tries=1 and only go through the circuit breaker.
+retry = functools.partial(
+    retry_transient,
+    circuit_breaker,
+    delay=RETRY_DELAY,
+    max_delay=RETRY_MAX_DELAY,
+    budget=RETRY_BUDGET,
+    cleanup=db.session.rollback,
+    logger=logger,
+)
 
 
 # Function to initialize the database
@@ -28,10 +61,124 @@ def init_db(app):
     Product.init_db(app)
 
 
+######################################################################
+#  S Q L   A C C O U N T I N G
+######################################################################
+def init_query_log(engines):
+    """Times every statement run by the engines"""
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def start_query_accounting():
+    """Starts counting the statements of the current request"""
+    g.db_queries = 0
+    g.db_time = 0.0
+    g.db_statements = {}
+
+
+def end_query_accounting():
+    """Reports a request that ran one statement N_PLUS_ONE_THRESHOLD times or more"""
+    statements = g.pop("db_statements", None)
+    threshold = current_app.config["N_PLUS_ONE_THRESHOLD"]
+    if not statements or threshold <= 0:
+        return
+    for statement, count in statements.items():
+        if count >= threshold:
+            logger.warning(
+                "Possible N+1 in %s %s: %s queries, %s of them: %s",
+                request.method, request.path, g.db_queries, count, statement,
+            )
+
+
+# pylint: disable=unused-argument, too-many-arguments
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Notes when a statement starts"""
+    conn.info["query_start"] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """Counts a statement against the current request and logs it if it was slow"""
+    start = conn.info.pop("query_start", None)
+    if start is None or not has_app_context():
+        return
+    elapsed = time.perf_counter() - start
+    route = "-"
+    if has_request_context():
+        route = f"{request.method} {request.path}"
+        if "db_statements" in g:
+            g.db_queries += 1
+            g.db_time += elapsed
+            g.db_statements[statement] = g.db_statements.get(statement, 0) + 1
+    threshold = current_app.config["SLOW_QUERY_THRESHOLD"]
+    if 0 < threshold <= elapsed:
+        logger.warning(
+            "Slow query (%.3fs) in %s: %s parameters=%.500r", elapsed, route, statement, parameters
+        )
+
+
 class DataValidationError(Exception):
     """ Used for an data validation errors when deserializing """
 
-# pylint: disable=too-many-instance-attributes
+
+class OutOfStockError(Exception):
+    """ Used when a Product cannot be purchased in the requested quantity """
+
+    def __init__(self, available: bool, stock: int):
+        super().__init__(f"available={available}, stock={stock}")
+        self.available = available
+        self.stock = stock
+
+
+def encode_cursor(sort: str, values: list) -> str:
+    """Encodes the sort key values of the last row of a page into an opaque cursor"""
+    values = [value.isoformat() if isinstance(value, date) else value for value in values]
+    payload = json.dumps({"sort": sort, "after": values}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, columns: list) -> list:
+    """Decodes a cursor back into the sort key values for the given columns"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if payload["sort"] != sort or len(payload["after"]) != len(columns):
+            raise ValueError("cursor does not match the requested sort")
+        return [
+            date.fromisoformat(value) if isinstance(column.type, db.Date) else value
+            for column, value in zip(columns, payload["after"])
+        ]
+    except (ValueError, KeyError, TypeError) as error:
+        raise DataValidationError("Invalid cursor: " + cursor) from error
+
+
+class SearchDocument(ColumnElement):  # pylint: disable=abstract-method, too-many-ancestors
+    """The text that Product.search() matches: name and description
+
+    On PostgreSQL it is a tsvector with the name weighted above the
+    description, elsewhere the lower-cased text, for the LIKE fallback.
+    """
+
+    inherit_cache = True
+
+
+@compiles(SearchDocument)
+def compile_search_document(element, compiler, **kwargs):  # pylint: disable=unused-argument
+    """Lower-cased name and description"""
+    return "lower(coalesce(name, '') || ' ' || coalesce(\"desc\", ''))"
+
+
+@compiles(SearchDocument, "postgresql")
+def compile_search_document_postgresql(element, compiler, **kwargs):  # pylint: disable=unused-argument
+    """English tsvector of the name (weight A) and the description (weight B)"""
+    return (
+        "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(\"desc\", '')), 'B')"
+    )
+
+
+# pylint: disable=too-many-instance-attributes, too-many-public-methods
 
 
 class Product(db.Model):
@@ -40,6 +187,38 @@ class Product(db.Model):
     """
 
     app = None
+    # read-through cache of row data in front of find_cached(), set up in init_db()
+    cache = LRUCache(maxsize=0)
+    # totals of stats(cached=True), kept current by the writes, set up in init_db()
+    totals = AggregateCache(ttl=0)
+
+    # Columns that find_by_filters() can match on
+    FILTERS = ("id", "name", "category", "price", "stock", "create_date", "available")
+
+    # Columns that update_many() can change
+    UPDATABLE = ("name", "price", "desc", "category", "stock", "create_date", "available", "likes")
+
+    # Range filters of find_by_filters(): the column each one bounds and how
+    RANGES = {
+        "min_price": ("price", operator.ge),
+        "max_price": ("price", operator.le),
+        "min_stock": ("stock", operator.ge),
+        "created_after": ("create_date", operator.gt),
+        "created_before": ("create_date", operator.lt),
+    }
+
+    # Columns that stats() can group by, and the columns it sums per group
+    STATS_GROUPS = ("category", "available", "create_date")
+    STATS_TOTALS = ("stock", "price", "likes")
+
+    # Keyset orderings for paginate(); each one ends with the unique id and
+    # has an index with the same columns. A "-" in front reverses the order.
+    SORT_KEYS = {
+        "id": ("id",),
+        "price": ("price", "id"),
+        "stock": ("stock", "id"),
+        "create_date": ("create_date", "id"),
+    }
 
     # Table Schema
     id = db.Column(db.Integer, primary_key=True)
@@ -51,17 +230,47 @@ class Product(db.Model):
     create_date = db.Column(db.Date(), nullable=False, default=date.today())
     available = db.Column(db.Boolean(), nullable=False, default=True)
     likes = db.Column(db.Integer(), nullable=False, default=0)
+    # row version and modification time, used as HTTP cache validators (ETag, Last-Modified)
+    version = db.Column(db.Integer(), nullable=False, default=1, server_default="1")
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        nullable=False,
+        default=func.now(),  # pylint: disable=not-callable
+        onupdate=func.now(),  # pylint: disable=not-callable
+        server_default=func.now(),  # pylint: disable=not-callable
+    )
+    # full-text search document, kept up to date by the database; it is left out of the
+    # mapper (see __mapper_args__) so that loads and INSERT ... RETURNING never carry it
+    search_vector = db.Column(
+        db.Text().with_variant(TSVECTOR(), "postgresql"), db.Computed(SearchDocument(), persisted=True)
+    )
+    __mapper_args__ = {"exclude_properties": ["search_vector"]}
+
+    # Secondary indexes for the find_by_* queries and keyset orderings.
+    # Build them on a live table with: flask db-index
+    __table_args__ = (
+        db.Index("ix_product_name", "name"),
+        db.Index("ix_product_price_id", "price", "id"),
+        db.Index("ix_product_stock_id", "stock", "id"),
+        db.Index("ix_product_create_date_id", "create_date", "id"),
+        # category alone is served by the leading column of these pairs
+        db.Index("ix_product_category_price", "category", "price", "id"),
+        db.Index("ix_product_category_available", "category", "available"),
+        # inverted index of the search document, for Product.search()
+        db.Index("ix_product_search", "search_vector", postgresql_using="gin").ddl_if(dialect="postgresql"),
+        # partial index: the storefront only ever lists available products
+        db.Index(
+            "ix_product_available",
+            "id",
+            postgresql_where=text("available = true"),
+            sqlite_where=text("available = 1"),
+        ),
+    )
 
     def __repr__(self):
         return f"<Product {self.name} id=[{self.id}]>"
 
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
+    @retry(tries=1)
     def create(self):
         """
         Creates a Product to the database
@@ -69,15 +278,162 @@ class Product(db.Model):
         logger.info("Creating product %s", self.name)
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
+        db.session.flush()
+        row = self.stats_row()
         db.session.commit()
+        self.count_in_stats(row)
 
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
+    @classmethod
+    @retry(tries=1)
+    def create_many(cls, products: list, batch_size: int = 1000) -> list:
+        """Creates many Products using one multi-row INSERT per batch
+
+        Each batch is committed on its own. If the database rejects a batch it
+        is retried row by row so that only the offending Products fail.
+
+        :param products: the deserialized Products to create
+        :param batch_size: the number of Products per INSERT and transaction
+
+        :return: an error message for each Product, or None if it was created
+        :rtype: list
+
+        """
+        logger.info("Creating %s products in batches of %s", len(products), batch_size)
+        errors = []
+        for start in range(0, len(products), batch_size):
+            errors.extend(cls._insert_batch(products[start:start + batch_size]))
+        return errors
+
+    @classmethod
+    def _insert_batch(cls, products: list) -> list:
+        """Inserts and commits one batch of Products"""
+        for product in products:
+            product.id = None
+        db.session.add_all(products)
+        try:
+            db.session.flush()
+            rows = [product.stats_row() for product in products]
+            db.session.commit()
+        except DBAPIError as error:
+            db.session.rollback()
+            if len(products) == 1:
+                return [str(error.orig).strip()]
+            logger.warning("Batch of %s rejected, retrying row by row: %s", len(products), error.orig)
+            errors = []
+            for product in products:
+                errors.extend(cls._insert_batch([product]))
+            return errors
+        for row in rows:
+            cls.count_in_stats(row)
+        return [None] * len(products)
+
+    @classmethod
+    @retry(tries=1)
+    def update_many(cls, changes: dict, ids: list = None, filters: dict = None) -> int:
+        """Applies the same changes to many Products in one UPDATE statement
+
+        :param changes: column names from UPDATABLE and their new values
+        :param ids: the ids of the Products to change
+        :param filters: filters as in find_by_filters() that the Products must match
+
+        :return: the number of Products updated
+        :rtype: int
+
+        """
+        values = cls._validate_changes(changes)
+        query = cls._bulk_query(ids, filters)
+        logger.info("Updating products with %s", values)
+        try:
+            values.update({cls.version: cls.version + 1, cls.updated_at: func.now()})  # pylint: disable=not-callable
+            count = query.update(values, synchronize_session=False)
+            db.session.commit()
+        except DBAPIError as error:
+            db.session.rollback()
+            raise DataValidationError("Invalid update: " + str(error.orig).strip()) from error
+        cls.cache.clear()
+        cls.totals.clear()
+        return count
+
+    @classmethod
+    @retry(tries=RETRY_COUNT)
+    def delete_many(cls, ids: list = None, filters: dict = None) -> int:
+        """Removes many Products in one DELETE statement
+
+        :param ids: the ids of the Products to remove
+        :param filters: filters as in find_by_filters() that the Products must match
+
+        :return: the number of Products deleted
+        :rtype: int
+
+        """
+        query = cls._bulk_query(ids, filters)
+        logger.info("Deleting products")
+        count = query.delete(synchronize_session=False)
+        db.session.commit()
+        cls.cache.clear()
+        cls.totals.clear()
+        return count
+
+    @classmethod
+    def _bulk_query(cls, ids: list = None, filters: dict = None):
+        """Returns the query selecting the Products of a bulk operation"""
+        filters = {name: value for name, value in (filters or {}).items() if value is not None}
+        if not ids and not filters:
+            raise DataValidationError("Bulk operations need a list of ids or a filter")
+        query = cls.find_by_filters(**cls._validate_filters(filters))
+        if ids:
+            if not all(isinstance(product_id, int) and not isinstance(product_id, bool) for product_id in ids):
+                raise DataValidationError("Invalid ids: must be a list of integers")
+            query = query.filter(cls.id.in_(ids))
+        return query
+
+    @classmethod
+    def _validate_filters(cls, filters: dict) -> dict:
+        """Checks the filter values of a bulk operation against the types of their columns"""
+        values = {}
+        for name, value in filters.items():
+            column = cls.__table__.columns.get(cls.RANGES.get(name, (name,))[0])
+            if column is None:
+                values[name] = value  # find_by_filters() rejects unknown filters
+                continue
+            python_type = column.type.python_type
+            if python_type is date and isinstance(value, str):
+                try:
+                    value = date.fromisoformat(value)
+                except ValueError as error:
+                    raise DataValidationError(f"Invalid filter: {name}: {error}") from error
+            number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if python_type is float:
+                valid = number
+            elif python_type is int:
+                valid = number and isinstance(value, int)
+            else:
+                valid = isinstance(value, python_type)
+            if not valid:
+                raise DataValidationError(f"Invalid filter: {name} must be a valid {python_type.__name__}")
+            values[name] = value
+        return values
+
+    @classmethod
+    def _validate_changes(cls, changes: dict) -> dict:
+        """Checks the changes of a bulk update and converts them to column values"""
+        if not isinstance(changes, dict) or not changes:
+            raise DataValidationError("Invalid update: changes must be a non-empty object")
+        unknown = set(changes) - set(cls.UPDATABLE)
+        if unknown:
+            raise DataValidationError("Invalid update: cannot change " + ", ".join(sorted(unknown)))
+        values = dict(changes)
+        if "available" in values and not isinstance(values["available"], bool):
+            raise DataValidationError("Invalid Attribute: available must be a boolean: "
+                                      + str(type(values["available"])))
+        if "create_date" in values:
+            try:
+                values["create_date"] = date.fromisoformat(values["create_date"])
+            except (TypeError, ValueError) as error:
+                raise DataValidationError("Invalid update: " + str(error)) from error
+        return {getattr(cls, name): value for name, value in values.items()}
+
+    @retry(tries=1)
     def update(self):
         """
         Updates a Product to the database
@@ -85,20 +441,172 @@ class Product(db.Model):
         logger.info("Saving %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
+        product_id = int(self.id)
+        previous, current = self.stats_row(previous=True), self.stats_row()
+        self.version = Product.version + 1
         db.session.commit()
+        self.cache.delete(product_id)
+        if previous is None:
+            self.totals.clear()
+        else:
+            self.count_in_stats(previous, -1)
+            self.count_in_stats(current)
 
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
+    @retry(tries=RETRY_COUNT)
     def delete(self):
         """ Removes a Product from the data store """
         logger.info("Deleting product %s", self.name)
+        product_id = self.id
+        row = self.stats_row()
         db.session.delete(self)
         db.session.commit()
+        self.cache.delete(product_id)
+        self.count_in_stats(row, -1)
+
+    @classmethod
+    @retry(tries=1)
+    def purchase(cls, product_id: int, quantity: int = 1):
+        """Atomically takes a quantity of a Product out of stock
+
+        The stock check and the decrement happen in one conditional UPDATE,
+        so concurrent purchases can neither lose decrements nor oversell. On
+        PostgreSQL the UPDATE runs in a CTE next to a read of the same row, so
+        one round trip also tells a missing Product apart from one that is out
+        of stock. Other databases cannot run an UPDATE in a CTE, so there a
+        failed purchase reads the row again.
+
+        :param product_id: the id of the Product to purchase
+        :param quantity: the number of units to purchase
+
+        :return: the Product after the purchase, or None if it was not found
+        :rtype: Product
+
+        :raises OutOfStockError: if the Product is unavailable or has too little stock
+
+        """
+        logger.info("Purchasing %s of product %s ...", quantity, product_id)
+        table = cls.__table__
+        # the mapped columns, without the search document
+        columns = list(cls.__mapper__.columns)
+        purchased = (
+            update(table)
+            .where(table.c.id == product_id, table.c.available.is_(True), table.c.stock >= quantity)
+            .values(
+                stock=table.c.stock - quantity,
+                available=table.c.stock > quantity,
+                version=table.c.version + 1,
+                updated_at=func.now(),  # pylint: disable=not-callable
+            )
+            .returning(*columns)
+        )
+        if db.engine.dialect.name == "postgresql":
+            row, before = cls._purchase_with_snapshot(purchased, product_id)
+        else:
+            row = db.session.execute(purchased).first()
+            before = None
+            if row is None:
+                before = db.session.execute(select(table.c.available, table.c.stock).where(table.c.id == product_id)).first()
+        db.session.commit()
+        if row is None:
+            if before is None:
+                return None
+            raise OutOfStockError(*before)
+        cls.cache.delete(int(product_id))
+        # only an available Product with enough stock was updated
+        current = {name: getattr(row, name) for name in (*cls.STATS_GROUPS, *cls.STATS_TOTALS)}
+        cls.count_in_stats({**current, "available": True, "stock": row.stock + quantity}, -1)
+        cls.count_in_stats(current)
+        return cls(**{column.name: getattr(row, column.name) for column in columns})
+
+    @classmethod
+    def _purchase_with_snapshot(cls, purchased, product_id: int) -> tuple:
+        """Runs the UPDATE of a purchase in a CTE joined to the row as it was before it
+
+        The row before the UPDATE comes from the snapshot of the statement, so
+        a concurrent purchase that made the UPDATE fail may not show in it.
+
+        :return: the row the UPDATE returned, or None if it failed, and the
+            availability and stock before it, or None if there is no such Product
+        :rtype: tuple
+
+        """
+        purchased = purchased.cte("purchased")
+        before = cls.__table__.alias("before")
+        statement = (
+            select(before.c.available.label("was_available"), before.c.stock.label("had_stock"), *purchased.c)
+            .select_from(before.outerjoin(purchased, purchased.c.id == before.c.id))
+            .where(before.c.id == product_id)
+        )
+        row = db.session.execute(statement).first()
+        if row is None:
+            return None, None
+        return (row if row.id is not None else None), (row.was_available, row.had_stock)
+
+    @classmethod
+    @retry(tries=1)
+    def add_likes(cls, counts: dict):
+        """Adds aggregated likes to many Products in one transaction
+
+        :param counts: the number of new likes for each Product id
+        :type counts: dict
+
+        """
+        logger.info("Adding likes to %s products", len(counts))
+        table = cls.__table__
+        statement = (
+            update(table)
+            .where(table.c.id == bindparam("product_id"))
+            .values(
+                likes=table.c.likes + bindparam("increment"),
+                version=table.c.version + 1,
+                updated_at=func.now(),  # pylint: disable=not-callable
+            )
+        )
+        # update in id order so concurrent flushes from other workers cannot deadlock
+        db.session.execute(
+            statement,
+            [{"product_id": product_id, "increment": count} for product_id, count in sorted(counts.items())],
+        )
+        db.session.commit()
+        cls.cache.delete(*counts)
+        if not cls.totals.loaded():
+            cls.totals.clear()  # still drops a load that raced with this write
+            return
+        # the likes go to the groups of each Product, read back by primary key
+        groups = select(table.c.id, *(table.c[name] for name in cls.STATS_GROUPS)).where(table.c.id.in_(counts))
+        for row in db.session.execute(groups).all():
+            cls.totals.apply(
+                {name: getattr(row, name) for name in cls.STATS_GROUPS},
+                (0, *(counts[row.id] if name == "likes" else 0 for name in cls.STATS_TOTALS)),
+            )
+
+    def stats_row(self, previous: bool = False) -> dict:
+        """Returns the STATS_GROUPS and STATS_TOTALS values of the Product
+
+        :param previous: return the values as loaded from the database instead of the changed ones,
+            or None when they were not all loaded
+
+        """
+        names = (*self.STATS_GROUPS, *self.STATS_TOTALS)
+        if not previous:
+            return {name: getattr(self, name) for name in names}
+        row = {}
+        attributes = inspect(self).attrs
+        for name in names:
+            history = attributes[name].history
+            loaded = history.deleted or history.unchanged
+            if not loaded:
+                return None
+            row[name] = loaded[0]
+        return row
+
+    @classmethod
+    def count_in_stats(cls, row: dict, sign: int = 1):
+        """Adds a row from stats_row() to the cached stats totals, or takes it out with a sign of -1"""
+        cls.totals.apply(
+            {name: row[name] for name in cls.STATS_GROUPS},
+            (sign, *(sign * row[name] for name in cls.STATS_TOTALS)),
+        )
 
     def serialize(self):
         """ Serializes a Product into a dictionary """
@@ -139,6 +647,8 @@ class Product(db.Model):
             raise DataValidationError("Invalid Product: missing " + error.args[0]) from error
         except TypeError as error:
             raise DataValidationError("Invalid Product: body of request contained bad or no data " + str(error)) from error
+        except ValueError as error:
+            raise DataValidationError("Invalid Product: " + str(error)) from error
         return self
 
     @classmethod
@@ -146,45 +656,207 @@ class Product(db.Model):
         """ Initializes the database session """
         logger.info("Initializing database")
         cls.app = app
+        cls.cache = LRUCache(app.config["PRODUCT_CACHE_SIZE"], app.config["PRODUCT_CACHE_TTL"])
+        cls.totals = AggregateCache(app.config["PRODUCT_STATS_TTL"])
         # This is where we initialize SQLAlchemy from the Flask app
         db.init_app(app)
         app.app_context().push()
+        init_query_log(db.engines.values())
         db.create_all()  # make our sqlalchemy tables
 
     @classmethod
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
+    @retry(tries=RETRY_COUNT)
     def all(cls) -> list:
         """ Returns all of the Products in the database """
         logger.info("Processing all Products")
         return cls.query.all()
 
     @classmethod
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
+    @retry(tries=RETRY_COUNT)
+    def paginate(cls, query, limit: int, sort: str = "id", cursor: str = None) -> tuple:
+        """Returns one page of a query using keyset (seek) pagination
+
+        Rows are ordered by the sort key and the page starts right after the
+        row encoded in the cursor, so every page costs the same as the first.
+
+        :param query: the query to page through, e.g. from find_by_name()
+        :param limit: the maximum number of Products on the page
+        :param sort: the name of the ordering in SORT_KEYS, with a "-" in front for descending
+        :param cursor: the cursor returned with the previous page, if any
+
+        :return: the Products on the page and the cursor of the next page (None on the last page)
+        :rtype: tuple
+
+        """
+        logger.info("Processing page of %s sorted by %s ...", limit, sort)
+        columns, descending = cls.sort_columns(sort)
+        if cursor:
+            values = decode_cursor(cursor, sort, columns)
+            after = tuple_(*columns) < tuple_(*values) if descending else tuple_(*columns) > tuple_(*values)
+            query = query.filter(after)
+        products = cls.order(query, sort).limit(limit + 1).all()
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            last = products[-1]
+            next_cursor = encode_cursor(sort, [getattr(last, column.key) for column in columns])
+        return products, next_cursor
+
+    @classmethod
+    def sort_columns(cls, sort: str) -> tuple:
+        """Returns the columns of an ordering in SORT_KEYS and whether it is descending"""
+        name = sort[1:] if sort and sort.startswith("-") else sort
+        if name not in cls.SORT_KEYS:
+            raise DataValidationError("Invalid sort key: " + str(sort))
+        return [getattr(cls, key) for key in cls.SORT_KEYS[name]], name != sort
+
+    @classmethod
+    @retry(tries=RETRY_COUNT)
+    def fetch(cls, query, sort: str = None) -> list:
+        """Returns every row of a query
+
+        The find_by_* methods only build queries, so this is where the rows
+        of a whole list are read, and where a transient failure is retried.
+
+        :param query: the query to read, e.g. from find_by_filters()
+        :param sort: the name of the ordering in SORT_KEYS, if the rows are ordered
+
+        :return: the rows of the query
+        :rtype: list
+
+        """
+        logger.info("Processing list query sorted by %s ...", sort)
+        return (cls.order(query, sort) if sort else query).all()
+
+    @classmethod
+    def order(cls, query, sort: str):
+        """Orders a query by one of the SORT_KEYS, all columns in the same direction so one index serves it"""
+        columns, descending = cls.sort_columns(sort)
+        return query.order_by(*[column.desc() if descending else column for column in columns])
+
+    @classmethod
+    @retry(tries=RETRY_COUNT)
+    def fingerprint(cls, query) -> tuple:
+        """Summarizes the rows of a query so that any change to them shows
+
+        Every write bumps the version and updated_at of its row, and deletes
+        change the count, so the summary changes whenever the rows do.
+
+        :param query: the query to summarize, e.g. from find_by_filters()
+
+        :return: the row count, the latest updated_at and the sum of the versions
+        :rtype: tuple
+
+        """
+        logger.info("Processing fingerprint query ...")
+        row = query.with_entities(
+            func.count(cls.id),  # pylint: disable=not-callable
+            func.max(cls.updated_at),  # pylint: disable=not-callable
+            func.coalesce(func.sum(cls.version), 0),  # pylint: disable=not-callable
+        ).one()
+        return tuple(row)
+
+    @classmethod
+    @retry(tries=RETRY_COUNT)
+    def count(cls, query) -> int:
+        """Returns the exact number of rows of a query, e.g. from find_by_filters()"""
+        logger.info("Processing count query ...")
+        return query.with_entities(func.count(cls.id)).scalar()  # pylint: disable=not-callable
+
+    @classmethod
+    @retry(tries=RETRY_COUNT)
+    def estimate_count(cls, query) -> int:
+        """Estimates the number of rows of a query from the planner's statistics
+
+        On PostgreSQL an unfiltered query takes the row count of the table
+        kept by ANALYZE and autovacuum (pg_class.reltuples), a filtered one the
+        rows EXPLAIN expects it to return. Neither reads the table, so the
+        estimate can be off by the writes since the last ANALYZE. Other
+        databases count the rows.
+
+        :param query: the query to count, e.g. from find_by_filters()
+
+        :return: the estimated number of rows
+        :rtype: int
+
+        """
+        logger.info("Processing estimated count query ...")
+        query = query.with_entities(cls.id)
+        connection = db.session.connection()
+        if connection.dialect.name != "postgresql":
+            return query.count()
+        if query.whereclause is None:
+            reltuples = db.session.execute(
+                text("SELECT reltuples FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                {"table": cls.__tablename__},
+            ).scalar()
+            # -1 until the table is first analyzed, then EXPLAIN scales by its size instead
+            if reltuples >= 0:
+                return int(reltuples)
+        compiled = query.statement.compile(dialect=connection.dialect)
+        plan = connection.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+    @classmethod
+    @retry(tries=RETRY_COUNT)
+    def stream(cls, query, batch_size: int = 1000):
+        """Returns an iterator over the Products of a query without loading them all at once
+
+        The rows are read from a server-side cursor batch_size at a time, and
+        Products that have been consumed can be garbage collected. The query
+        runs and its first batch is read before this returns, so a failure to
+        start it is retried; once rows have been sent, a failure ends the stream.
+
+        :param query: the query to stream, e.g. from find_by_filters()
+        :param batch_size: the number of rows fetched per round trip
+
+        :return: an iterator of Products ordered by id
+        :rtype: iterator
+
+        """
+        logger.info("Processing streamed query in batches of %s ...", batch_size)
+        rows = iter(query.order_by(cls.id).yield_per(batch_size))
+        first = list(itertools.islice(rows, 1))
+        return itertools.chain(first, rows)
+
+    @classmethod
+    @retry(tries=RETRY_COUNT)
     def find(cls, product_id: int):
         """ Finds a Product by it's ID """
         logger.info("Processing lookup for id %s ...", product_id)
         return cls.query.get(product_id)
 
     @classmethod
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
+    def find_cached(cls, product_id: int):
+        """Finds a Product by it's ID through the read-through cache
+
+        The Product returned is not attached to the database session, so it
+        is only meant to be read; use find() for a Product you will change.
+        A client pinned to the primary after a write skips the cache, which may
+        hold a copy read from a lagging replica, and refreshes it instead.
+
+        :param product_id: the id of the Product to find
+        :type product_id: int
+
+        :return: a read-only Product, or None if not found
+        :rtype: Product
+
+        """
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return None
+        data = None if pinned_to_primary() else cls.cache.get(product_id)
+        if data is None:
+            product = cls.find(product_id)
+            if product is None:
+                return None
+            data = {column.key: getattr(product, column.key) for column in cls.__mapper__.column_attrs}
+            cls.cache.set(product_id, data)
+        return cls(**data)
+
+    @classmethod
+    @retry(tries=RETRY_COUNT)
     def find_or_404(cls, product_id: int):
         """Find a Product by it's id
 
@@ -199,13 +871,6 @@ class Product(db.Model):
         return cls.query.get_or_404(product_id)
 
     @classmethod
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
     def find_by_name(cls, name: str) -> list:
         """Returns all Products with the given name
 
@@ -220,13 +885,6 @@ class Product(db.Model):
         return cls.query.filter(cls.name == name)
 
     @classmethod
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
     def find_by_category(cls, category: str) -> list:
         """Returns all of the Products in a category
 
@@ -241,13 +899,6 @@ class Product(db.Model):
         return cls.query.filter(cls.category == category)
 
     @classmethod
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
     def find_by_price(cls, price: float) -> list:
         """Returns all of the Products of a given price
 
@@ -262,13 +913,6 @@ class Product(db.Model):
         return cls.query.filter(cls.price == price)
 
     @classmethod
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
     def find_by_stock(cls, stock: int) -> list:
         """Returns all of the Products of a given stock
 
@@ -283,13 +927,6 @@ class Product(db.Model):
         return cls.query.filter(cls.stock == stock)
 
     @classmethod
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
     def find_by_create_date(cls, create_date: date) -> list:
         """Returns all of the Products of a given date
 
@@ -304,13 +941,6 @@ class Product(db.Model):
         return cls.query.filter(cls.create_date == create_date)
 
     @classmethod
-    @retry(
-        HTTPError,
-        delay=RETRY_DELAY,
-        backoff=RETRY_BACKOFF,
-        tries=RETRY_COUNT,
-        logger=logger,
-    )
     def find_by_available(cls, available: bool = True) -> list:
         """Returns all of the Products that are available
 
@@ -324,6 +954,108 @@ class Product(db.Model):
         logger.info("Processing availability query for %s ...", available)
         return cls.query.filter(cls.available == available)
 
+    @classmethod
+    def find_by_filters(cls, **filters):
+        """Returns all of the Products that match every given filter
+
+        The filters are combined into a single WHERE clause; filters whose
+        value is None are ignored, so no filters at all matches every Product.
+        Range filters, e.g. min_price, bound their column instead of matching it.
+
+        :param filters: column names from FILTERS or names from RANGES, and their values
+
+        :return: a query of the Products that match
+        :rtype: Query
+
+        """
+        unknown = set(filters) - set(cls.FILTERS) - set(cls.RANGES)
+        if unknown:
+            raise DataValidationError("Invalid filter: " + ", ".join(sorted(unknown)))
+        criteria = {name: value for name, value in filters.items() if value is not None}
+        logger.info("Processing filter query for %s ...", criteria)
+        clauses = []
+        for name, value in criteria.items():
+            column, compare = cls.RANGES.get(name, (name, operator.eq))
+            clauses.append(compare(getattr(cls, column), value))
+        return cls.query.filter(*clauses)
+
+    @classmethod
+    @retry(tries=RETRY_COUNT)
+    def search(cls, query, terms: str, limit: int, cursor: str = None, timeout: int = 0) -> tuple:
+        """Returns one page of the Products whose name or description match a text query, best match first
+
+        On PostgreSQL the terms are parsed like a web search box ("quoted
+        phrase", or, -word), stemmed and matched through the GIN index of
+        search_vector; matches in the name rank above those in the description.
+        Elsewhere every word must appear in the name or the description and all
+        matches rank the same. Pages are cut on (rank, id) like paginate().
+
+        :param query: the query to search, e.g. cls.query or one with_entities()
+        :param terms: the text to search for
+        :param limit: the maximum number of rows on the page
+        :param cursor: the cursor returned with the previous page, if any
+        :param timeout: milliseconds after which PostgreSQL cancels the search, 0 for no limit
+
+        :return: the rows of the query followed by the id and rank of each match, and the cursor
+                 of the next page (None on the last page)
+        :rtype: tuple
+
+        """
+        logger.info("Processing search for %s ...", terms)
+        if db.engine.dialect.name == "postgresql":
+            tsquery = func.websearch_to_tsquery("english", terms)
+            match = cls.search_vector.op("@@")(tsquery)
+            rank = cast(func.ts_rank(cls.search_vector, tsquery), db.Float)
+            if timeout:
+                # only for this transaction, which ends with the request
+                db.session.execute(select(func.set_config("statement_timeout", str(timeout), True)))
+        else:
+            match = and_(*[cls.search_vector.contains(word, autoescape=True) for word in terms.lower().split()])
+            rank = literal(0.0, db.Float)
+        query = query.filter(match).add_columns(cls.id, rank)
+        if cursor:
+            last_rank, last_id = decode_cursor(cursor, "rank", [rank, cls.id])
+            query = query.filter(or_(rank < last_rank, and_(rank == last_rank, cls.id > last_id)))
+        rows = query.order_by(rank.desc(), cls.id).limit(limit + 1).all()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor("rank", [rows[-1][-1], rows[-1][-2]])
+        return rows, next_cursor
+
+    @classmethod
+    @retry(tries=RETRY_COUNT)
+    def stats(cls, group_by: str, cached: bool = False) -> list:
+        """Returns the number of Products and the sums of STATS_TOTALS for each value of a column
+
+        The totals come from one GROUP BY query. When cached, they are read
+        from the in-process totals that the writes keep current, and the query
+        only runs to load a grouping the first time or after PRODUCT_STATS_TTL.
+
+        :param group_by: one of STATS_GROUPS
+        :param cached: read the totals kept in memory
+
+        :return: (group value, count, *sums of STATS_TOTALS) tuples ordered by group value
+        :rtype: list
+
+        """
+        if group_by not in cls.STATS_GROUPS:
+            raise DataValidationError(f"Invalid group_by: must be one of {', '.join(cls.STATS_GROUPS)}")
+        totals = cls.totals.get(group_by) if cached else None
+        if totals is None:
+            logger.info("Computing product stats by %s", group_by)
+            generation = cls.totals.generation
+            column = getattr(cls, group_by)
+            statement = select(
+                column,
+                func.count(),  # pylint: disable=not-callable
+                *(func.sum(getattr(cls, name)) for name in cls.STATS_TOTALS),  # pylint: disable=not-callable
+            ).group_by(column)
+            totals = {row[0]: list(row[1:]) for row in db.session.execute(statement).all()}
+            if cached:
+                cls.totals.set(group_by, totals, generation)
+        return [(key, *totals[key]) for key in sorted(totals)]
+
     # def purchase(self):
     #     """Purchases the product and updates the stock and availability"""
     #     if self.stock > 0:
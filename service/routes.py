@@ -6,14 +6,38 @@ Describe what your service does here
 
 
 # from flask import abort
-from flask_restx import Resource, fields, reqparse, inputs
+import csv
+import codecs
+import hashlib
+from datetime import datetime
+from functools import lru_cache
+from flask import request, stream_with_context
+from werkzeug.http import http_date, quote_etag
+from flask_restx import Resource, fields, reqparse, inputs, marshal
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import load_only
 from service.common import status  # HTTP Status Codes
-from service.models import Product
-# from service.common.utils import apply_filters
+from service.common.like_buffer import LikeBuffer
+from service.common.compression import ENCODINGS, send_static
+from service.common import serializers, importing
+from service.common.pooling import pool_stats
+from service.common.resilience import QUERY_CANCELED
+from service.models import db, circuit_breaker, start_query_accounting, end_query_accounting
+from service.models import Product, DataValidationError, OutOfStockError
 
 # Import Flask application
 from . import app, api
 
+
+def flush_likes(counts: dict):
+    """Writes buffered likes to the database"""
+    with app.app_context():
+        Product.add_likes(counts)
+
+
+# likes are aggregated per worker and written behind in batches
+like_buffer = LikeBuffer(flush_likes, app.config["LIKE_FLUSH_INTERVAL"], app.config["LIKE_FLUSH_MAX"])
+
 ############################################################
 # Health Endpoint
 ############################################################
@@ -24,6 +48,39 @@ def health():
     """Health Status"""
     return {"status": 'OK'}, status.HTTP_200_OK
 
+
+@app.route("/cache/stats")
+def cache_stats():
+    """Hit and miss counters of the product cache"""
+    return Product.cache.stats(), status.HTTP_200_OK
+
+
+@app.before_request
+def count_queries():
+    """Counts the SQL statements of every request"""
+    start_query_accounting()
+
+
+@app.teardown_request
+def release_connection(exception=None):  # pylint: disable=unused-argument
+    """Returns the connection to the pool at the end of every request
+
+    Requests share the app context pushed by init_db(), whose teardown never
+    runs, so without this each worker would keep a connection checked out.
+    """
+    db.session.remove()
+    end_query_accounting()
+
+
+@app.route("/db/pool/stats")
+def db_pool_stats():
+    """Connections checked out, overflow and checkout wait times of this worker's pool"""
+    stats = {**pool_stats(db.engine.pool), "circuit": circuit_breaker.stats()}
+    replica_pools = {key: pool_stats(engine.pool) for key, engine in db.engines.items() if key}
+    if replica_pools:
+        stats["replicas"] = replica_pools
+    return stats, status.HTTP_200_OK
+
 ######################################################################
 # GET INDEX
 ######################################################################
@@ -32,7 +89,7 @@ def health():
 @app.route("/")
 def index():
     """ Root URL response """
-    return app.send_static_file("index.html")
+    return send_static(app, "index.html")
 
 
 # Define the model so that the docs reflect what can be sent
@@ -69,33 +126,150 @@ product_model = api.inherit(
     },
 )
 
+read_args = reqparse.RequestParser()
+read_args.add_argument(
+    "pending_likes",
+    type=inputs.boolean,
+    location="args",
+    required=False,
+    default=False,
+    help="Include the likes that have not been written to the database yet",
+)
+
+purchase_args = reqparse.RequestParser()
+purchase_args.add_argument(
+    "quantity", type=int, location="args", required=False, default=1, help="Number of units to purchase"
+)
+
+batch_update_model = api.model(
+    "BatchUpdate",
+    {
+        "ids": fields.List(fields.Integer, description="The ids of the Products to change"),
+        "filter": fields.Raw(
+            description="Filters the Products must match, e.g. {\"category\": \"dog\", \"max_price\": 10}"
+        ),
+        "changes": fields.Raw(required=True, description="The new values, e.g. {\"price\": 9.99}"),
+    },
+)
+
+batch_delete_model = api.model(
+    "BatchDelete",
+    {
+        "ids": fields.List(fields.Integer, description="The ids of the Products to delete"),
+        "filter": fields.Raw(description="Filters the Products must match, e.g. {\"available\": false}"),
+    },
+)
+
+# fast path: the model compiled into one function over rows of the matching columns
+serialize_product = serializers.compile_serializer(product_model)
+product_columns = [getattr(Product, name) for name in serialize_product.fields]
+
+
+@lru_cache(maxsize=64)
+def sparse_serializer(names: tuple):
+    """Returns the compiled serializer for a sparse fieldset"""
+    return serializers.compile_serializer(product_model, names)
+
+
+# Ways of computing the X-Total-Count header of lists
+COUNT_MODES = ("exact", "estimated")
+
 # query string arguments
-product_args = reqparse.RequestParser()
-product_args.add_argument(
+filter_args = reqparse.RequestParser()
+filter_args.add_argument(
     "id", type=int, location="args", required=False, help="List Products by id"
 )
-product_args.add_argument(
+filter_args.add_argument(
     "name", type=str, location="args", required=False, help="List Products by name"
 )
-product_args.add_argument(
+filter_args.add_argument(
     "category", type=str, location="args", required=False, help="List Products by category"
 )
-product_args.add_argument(
+filter_args.add_argument(
     "price", type=float, location="args", required=False, help="List Products by price"
 )
-product_args.add_argument(
+filter_args.add_argument(
     "stock", type=int, location="args", required=False, help="List Products by stock"
 )
-product_args.add_argument(
+filter_args.add_argument(
     "create_date", type=inputs.date, location="args", required=False, help="List Products by create_date"
 )
-product_args.add_argument(
+filter_args.add_argument(
     "available",
     type=inputs.boolean,
     location="args",
     required=False,
     help="List Products by availability",
 )
+filter_args.add_argument(
+    "min_price", type=float, location="args", required=False, help="List Products priced at least this much"
+)
+filter_args.add_argument(
+    "max_price", type=float, location="args", required=False, help="List Products priced at most this much"
+)
+filter_args.add_argument(
+    "min_stock", type=int, location="args", required=False, help="List Products with at least this much stock"
+)
+filter_args.add_argument(
+    "created_after", type=inputs.date, location="args", required=False, help="List Products created after this date"
+)
+filter_args.add_argument(
+    "created_before", type=inputs.date, location="args", required=False, help="List Products created before this date"
+)
+# count arguments add how to count the matches to the filters
+count_args = filter_args.copy()
+count_args.add_argument(
+    "count",
+    type=str,
+    location="args",
+    required=False,
+    choices=COUNT_MODES,
+    help="How X-Total-Count is computed: exact, or estimated by the planner (TOTAL_COUNT_MODE by default)",
+)
+# list arguments add keyset paging to the counted filters
+product_args = count_args.copy()
+product_args.add_argument(
+    "limit", type=int, location="args", required=False, help="Maximum number of Products per page"
+)
+product_args.add_argument(
+    "cursor", type=str, location="args", required=False, help="Cursor of the page to return"
+)
+product_args.add_argument(
+    "sort",
+    type=str,
+    location="args",
+    required=False,
+    choices=[prefix + name for name in Product.SORT_KEYS for prefix in ("", "-")],
+    help="Sort key, - in front for descending (pages are sorted by id by default)",
+)
+product_args.add_argument(
+    "fields",
+    type=str,
+    location="args",
+    required=False,
+    help="Comma separated fields to return, e.g. id,name,price (all by default)",
+)
+
+search_args = reqparse.RequestParser()
+search_args.add_argument(
+    "q", type=str, location="args", required=True, help="Words to search for in the name and description"
+)
+search_args.add_argument(
+    "limit", type=int, location="args", required=False, help="Maximum number of Products per page"
+)
+search_args.add_argument(
+    "cursor", type=str, location="args", required=False, help="Cursor of the page to return"
+)
+
+stats_args = reqparse.RequestParser()
+stats_args.add_argument(
+    "group_by", type=str, location="args", required=False, default="category",
+    choices=list(Product.STATS_GROUPS), help="Column to group the products by",
+)
+stats_args.add_argument(
+    "cached", type=inputs.boolean, location="args", required=False, default=False,
+    help="Serve the totals kept in memory, up to PRODUCT_STATS_TTL seconds behind other workers",
+)
 
 
 ######################################################################
@@ -117,6 +291,7 @@ class ProductResource(Resource):
     # RETRIEVE A product
     # ------------------------------------------------------------------
     @api.doc("get_products")
+    @api.expect(read_args, validate=True)
     @api.response(404, "product not found")
     @api.marshal_with(product_model)
     def get(self, product_id):
@@ -126,10 +301,17 @@ class ProductResource(Resource):
         This endpoint will return a product based on it's id
         """
         app.logger.info("Request to Retrieve a product with id [%s]", product_id)
-        product = Product.find(product_id)
+        args = read_args.parse_args()
+        product = Product.find_cached(product_id)
         if not product:
             abort(status.HTTP_404_NOT_FOUND, f"product with id '{product_id}' was not found.")
-        return product.serialize(), status.HTTP_200_OK
+        etag = f"{product.id}-{product.version}"
+        if args["pending_likes"]:
+            etag += f"-{like_buffer.pending(product.id)}"
+        headers = check_not_modified(etag, product.updated_at)
+        if args["pending_likes"]:
+            return serialize_with_pending_likes(product), status.HTTP_200_OK, headers
+        return product.serialize(), status.HTTP_200_OK, headers
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING product
@@ -188,44 +370,62 @@ class ProductCollection(Resource):
     # ------------------------------------------------------------------
     @api.doc("list_products")
     @api.expect(product_args, validate=True)
-    @api.marshal_list_with(product_model)
+    @api.response(200, "Success", [product_model])
     def get(self):
         """Returns all of the products"""
         app.logger.info("Request to list products...")
         args = product_args.parse_args()
-        filtered = False
-        if args['name']:
-            app.logger.info("Filtering by name: %s", args['name'])
-            products = Product.find_by_name(args['name'])
-            filtered = True
-        elif args['price']:
-            app.logger.info("Filtering by price: %s", args['price'])
-            products = Product.find_by_price(args['price'])
-            filtered = True
-        elif args['category']:
-            app.logger.info("Filtering by category: %s", args['category'])
-            products = Product.find_by_category(args['category'])
-            filtered = True
-        elif args['stock']:
-            app.logger.info("Filtering by stock: %s", args['stock'])
-            products = Product.find_by_stock(args['stock'])
-            filtered = True
-        elif args['create_date']:
-            app.logger.info("Filtering by create_date: %s", args['create_date'])
-            products = Product.find_by_create_date(args['create_date'])
-            filtered = True
-        elif args['available']:
-            app.logger.info("Filtering by available: %s", args['available'])
-            products = Product.find_by_available(args['available'])
-            filtered = True
+        matches = Product.find_by_filters(**get_filters(args))
+        mode = args["count"] or app.config["TOTAL_COUNT_MODE"]
+        names = get_fields(args["fields"])
+        paged = args["limit"] is not None or args["cursor"]
+        sort = args["sort"] or ("id" if paged else None)
+        # a whole list with an exact count is validated before its rows are read,
+        # pages and lists with an estimated count by the rows read
+        by_rows = paged or mode == "estimated"
+        headers = {} if by_rows else collection_headers(matches, mode)
+        columns = list_columns(names, sort, by_rows)
+        if app.config["FAST_JSON"]:
+            products = matches.with_entities(*columns)
         else:
-            app.logger.info("Returning unfiltered list.")
-            products = Product.all()
-        if filtered:
-            products = products.all()
+            products = matches.options(load_only(*columns))
+        next_cursor = None
+        if paged:
+            products, next_cursor = Product.paginate(products, get_page_limit(args["limit"]), sort, args["cursor"])
+        else:
+            products = Product.fetch(products, sort)
+        if by_rows:
+            # rows read from the start to the end of the list are its count
+            total = len(products) if not args["cursor"] and next_cursor is None else None
+            headers = collection_headers(matches, mode, page=(products, next_cursor), total=total)
         app.logger.info("[%s] products returned", len(products))
-        results = [product.serialize() for product in products]
-        return results, status.HTTP_200_OK
+        if app.config["FAST_JSON"]:
+            serialize = sparse_serializer(tuple(names))
+            body = serializers.dumps([serialize(row) for row in products])
+            return app.response_class(body, status.HTTP_200_OK, headers, mimetype="application/json")
+        model = {name: product_model.resolved[name] for name in names}
+        return marshal(products, model), status.HTTP_200_OK, headers
+
+    # ------------------------------------------------------------------
+    # COUNT products
+    # ------------------------------------------------------------------
+    @api.doc("count_products")
+    @api.expect(count_args, validate=True)
+    @api.response(200, "The count is in X-Total-Count")
+    def head(self):
+        """
+        Count products
+
+        This endpoint returns the number of products matching the filters in X-Total-Count,
+        without reading the products themselves
+        """
+        app.logger.info("Request to count products...")
+        args = count_args.parse_args()
+        products = Product.find_by_filters(**get_filters(args))
+        # an estimate reads the planner's statistics and none of the table
+        headers = collection_headers(products, args["count"] or app.config["TOTAL_COUNT_MODE"], validators=False)
+        app.logger.info("[%s] products counted", headers["X-Total-Count"])
+        return app.response_class(status=status.HTTP_200_OK, headers=headers)
 
     # ------------------------------------------------------------------
     # ADD A NEW product
@@ -249,6 +449,238 @@ class ProductCollection(Resource):
         return product.serialize(), status.HTTP_201_CREATED, {"Location": location_url}
 
 
+######################################################################
+#  PATH: /products/batch
+######################################################################
+@api.route("/products/batch")
+class ProductBatch(Resource):
+    """Handles bulk operations on products"""
+
+    # ------------------------------------------------------------------
+    # ADD MANY NEW products
+    # ------------------------------------------------------------------
+    @api.doc("create_products_batch")
+    @api.response(201, "All of the products were created")
+    @api.response(207, "Some of the products were not valid")
+    @api.response(400, "The posted data was not a list")
+    @api.response(413, "Too many products in one request")
+    @api.expect([create_model])
+    def post(self):
+        """
+        Creates many products
+
+        This endpoint will create every valid product in the posted list and
+        report a result for each item in the same order
+        """
+        app.logger.info("Request to Create a batch of products")
+        data = api.payload
+        if not isinstance(data, list) or not data:
+            abort(status.HTTP_400_BAD_REQUEST, "Request body must be a non-empty list of products")
+        if len(data) > app.config["BATCH_MAX_ITEMS"]:
+            abort(
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                f"A batch can hold at most {app.config['BATCH_MAX_ITEMS']} products",
+            )
+        results = [None] * len(data)
+        valid = []
+        for position, item in enumerate(data):
+            try:
+                valid.append((position, Product().deserialize(item)))
+            except DataValidationError as error:
+                results[position] = {"index": position, "status": status.HTTP_400_BAD_REQUEST, "error": str(error)}
+        errors = Product.create_many([product for _, product in valid], app.config["BATCH_INSERT_SIZE"])
+        for (position, product), error in zip(valid, errors):
+            if error:
+                results[position] = {"index": position, "status": status.HTTP_400_BAD_REQUEST, "error": error}
+            else:
+                results[position] = {"index": position, "status": status.HTTP_201_CREATED, "product": product.serialize()}
+        created = sum(1 for result in results if result["status"] == status.HTTP_201_CREATED)
+        app.logger.info("[%s] of [%s] products created", created, len(results))
+        code = status.HTTP_201_CREATED if created == len(results) else status.HTTP_207_MULTI_STATUS
+        return {"created": created, "failed": len(results) - created, "results": results}, code
+
+    # ------------------------------------------------------------------
+    # UPDATE MANY EXISTING products
+    # ------------------------------------------------------------------
+    @api.doc("update_products_batch")
+    @api.response(400, "The posted data was not valid")
+    @api.expect(batch_update_model)
+    def patch(self):
+        """
+        Update many products
+
+        This endpoint will apply the same changes to every product selected by ids and/or filter
+        """
+        app.logger.info("Request to Update a batch of products")
+        data = get_batch_payload()
+        count = Product.update_many(data.get("changes"), data.get("ids"), data.get("filter"))
+        app.logger.info("[%s] products updated", count)
+        return {"updated": count}, status.HTTP_200_OK
+
+    # ------------------------------------------------------------------
+    # DELETE MANY products
+    # ------------------------------------------------------------------
+    @api.doc("delete_products_batch")
+    @api.response(400, "The posted data was not valid")
+    @api.expect(batch_delete_model)
+    def delete(self):
+        """
+        Delete many products
+
+        This endpoint will delete every product selected by ids and/or filter
+        """
+        app.logger.info("Request to Delete a batch of products")
+        data = get_batch_payload()
+        count = Product.delete_many(data.get("ids"), data.get("filter"))
+        app.logger.info("[%s] products deleted", count)
+        return {"deleted": count}, status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /products/export
+######################################################################
+@api.route("/products/export")
+class ProductExport(Resource):
+    """Streams the product catalog"""
+
+    @api.doc("export_products", produces=["application/x-ndjson"])
+    @api.expect(filter_args, validate=True)
+    def get(self):
+        """
+        Export products
+
+        This endpoint streams every product matching the filters as newline-delimited JSON
+        """
+        app.logger.info("Request to export products...")
+        args = filter_args.parse_args()
+        products = Product.find_by_filters(**get_filters(args)).with_entities(*product_columns)
+        rows = Product.stream(products, app.config["EXPORT_BATCH_SIZE"])
+
+        def generate():
+            for row in rows:
+                yield serializers.dumps(serialize_product(row)) + b"\n"
+
+        return app.response_class(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+######################################################################
+#  PATH: /products/search
+######################################################################
+@api.route("/products/search")
+class ProductSearch(Resource):
+    """Full-text search of the product catalog"""
+
+    @api.doc("search_products")
+    @api.expect(search_args, validate=True)
+    @api.response(200, "Success", [product_model])
+    @api.response(400, "The search terms were missing")
+    @api.response(503, "The search took longer than SEARCH_TIMEOUT")
+    def get(self):
+        """
+        Search products
+
+        This endpoint returns the products whose name or description match the words of q,
+        best match first, one page at a time
+        """
+        app.logger.info("Request to search products...")
+        args = search_args.parse_args()
+        terms = args["q"].strip()
+        if not terms:
+            abort(status.HTTP_400_BAD_REQUEST, "q must contain words to search for")
+        limit = get_page_limit(args["limit"])
+        fast_json = app.config["FAST_JSON"]
+        products = Product.query.with_entities(*product_columns) if fast_json else Product.query
+        try:
+            rows, next_cursor = Product.search(products, terms, limit, args["cursor"], app.config["SEARCH_TIMEOUT"])
+        except OperationalError as error:
+            if getattr(error.orig, "pgcode", None) != QUERY_CANCELED:
+                raise
+            db.session.rollback()
+            abort(status.HTTP_503_SERVICE_UNAVAILABLE, "The search took too long, try more specific words")
+        headers = page_headers(next_cursor, ProductSearch) if next_cursor else {}
+        app.logger.info("[%s] products found", len(rows))
+        if fast_json:
+            body = serializers.dumps([serialize_product(row) for row in rows])
+            return app.response_class(body, status.HTTP_200_OK, headers, mimetype="application/json")
+        return marshal([row[0] for row in rows], product_model), status.HTTP_200_OK, headers
+
+
+######################################################################
+#  PATH: /products/stats
+######################################################################
+@api.route("/products/stats")
+class ProductStats(Resource):
+    """Aggregates of the product catalog"""
+
+    @api.doc("product_stats")
+    @api.expect(stats_args, validate=True)
+    @api.response(200, "Success")
+    def get(self):
+        """
+        Product stats
+
+        This endpoint returns, for each value of group_by, the number of products,
+        their total stock, average price and total likes
+        """
+        app.logger.info("Request for product stats...")
+        args = stats_args.parse_args()
+        group_by = args["group_by"]
+        groups = Product.stats(group_by, args["cached"])
+        app.logger.info("[%s] groups returned", len(groups))
+        return [
+            {
+                group_by: key.isoformat() if group_by == "create_date" else key,
+                "count": count,
+                "total_stock": stock,
+                "average_price": price / count,
+                "total_likes": likes,
+            }
+            for key, count, stock, price, likes in groups
+        ], status.HTTP_200_OK
+
+
+######################################################################
+#  PATH: /products/import
+######################################################################
+@api.route("/products/import")
+class ProductImport(Resource):
+    """Bulk loads products from a file"""
+
+    @api.doc("import_products", consumes=list(importing.MIMETYPES))
+    @api.response(201, "All of the records were imported")
+    @api.response(207, "Some of the records were rejected")
+    @api.response(415, "The body was not CSV or NDJSON")
+    def post(self):
+        """
+        Import products
+
+        This endpoint streams a CSV file (with a header row) or an NDJSON file from the request body
+        and loads every valid record in one transaction. The first rejected records are listed.
+        """
+        app.logger.info("Request to import products...")
+        fmt = importing.detect_format(request.content_type, mimetypes=True)
+        if not fmt:
+            abort(
+                status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                f"Content-Type must be one of {', '.join(importing.MIMETYPES)}",
+            )
+        errors = []
+        max_errors = app.config["IMPORT_MAX_ERRORS"]
+
+        def reject(line, record, error):  # pylint: disable=unused-argument
+            if len(errors) < max_errors:
+                errors.append({"line": line, "error": error})
+
+        lines = codecs.iterdecode(request.stream, "utf-8-sig")
+        try:
+            counts = importing.import_products(lines, fmt, reject, app.config["IMPORT_BATCH_SIZE"])
+        except (UnicodeDecodeError, csv.Error) as error:
+            abort(status.HTTP_400_BAD_REQUEST, f"Unreadable file: {error}")
+        app.logger.info("[%s] products imported, [%s] rejected", counts["imported"], counts["rejected"])
+        code = status.HTTP_207_MULTI_STATUS if counts["rejected"] else status.HTTP_201_CREATED
+        return {**counts, "errors": errors}, code
+
+
 ######################################################################
 #  PATH: /products/{id}/purchase
 ######################################################################
@@ -258,28 +690,32 @@ class PurchaseResource(Resource):
     """Purchase actions on a product"""
 
     @api.doc("purchase_products")
+    @api.expect(purchase_args, validate=True)
+    @api.response(400, "The quantity was not valid")
     @api.response(404, "product not found")
     @api.response(409, "The product is not available for purchase")
     def put(self, product_id):
         """
         Purchase a product
 
-        This endpoint will purchase a product and make it unavailable
+        This endpoint will take the purchased quantity out of stock and make
+        the product unavailable once the stock runs out
         """
         app.logger.info("Request to Purchase a product")
-        product = Product.find(product_id)
+        quantity = purchase_args.parse_args()["quantity"]
+        if quantity < 1:
+            abort(status.HTTP_400_BAD_REQUEST, "quantity must be a positive integer")
+        try:
+            product = Product.purchase(product_id, quantity)
+        except OutOfStockError as error:
+            if not error.available:
+                abort(status.HTTP_409_CONFLICT, f"product with id [{product_id}] is not available.")
+            if error.stock >= quantity:
+                # the stock was read before a concurrent purchase took it
+                abort(status.HTTP_409_CONFLICT, f"product with id [{product_id}] was just purchased by someone else.")
+            abort(status.HTTP_409_CONFLICT, f"product with id [{product_id}] has only {error.stock} in stock.")
         if not product:
             abort(status.HTTP_404_NOT_FOUND, f"product with id [{product_id}] was not found.")
-        if not product.available:
-            abort(status.HTTP_409_CONFLICT, f"product with id [{product_id}] is not available.")
-        if product.stock > 0:
-            product.stock -= 1
-            if product.stock == 0:
-                product.available = False
-            # db.session.commit()
-            # return True
-        # product.available = False
-        product.update()
         app.logger.info("product with id [%s] has been purchased!", product.id)
         return product.serialize(), status.HTTP_200_OK
 
@@ -299,18 +735,16 @@ class LikeResource(Resource):
         """
         Like a product
 
-        This endpoint will like a product and increment the number of like by one
+        This endpoint will like a product and increment the number of like by one.
+        The like is buffered and written to the database shortly after.
         """
         app.logger.info("Request to Like a product")
-        product = Product.find(product_id)
+        product = Product.find_cached(product_id)
         if not product:
             abort(status.HTTP_404_NOT_FOUND, f"product with id [{product_id}] was not found.")
-        product.likes += 1
-        # product.id = product_id
-
-        product.update()
+        like_buffer.add(product.id)
         app.logger.info("product with id [%s] has been liked!", product.id)
-        return product.serialize(), status.HTTP_200_OK
+        return serialize_with_pending_likes(product), status.HTTP_200_OK
 
 
 ######################################################################
@@ -320,3 +754,131 @@ def abort(error_code: int, message: str):
     """Logs errors before aborting"""
     app.logger.error(message)
     api.abort(error_code, message)
+
+
+class NotModified(Exception):
+    """Raised to answer a conditional GET with 304 NOT MODIFIED"""
+
+    def __init__(self, headers: dict):
+        super().__init__("Not Modified")
+        self.headers = headers
+
+
+@api.errorhandler(NotModified)
+def not_modified(error):
+    """Sends 304 NOT MODIFIED with the validators and no body"""
+    return {}, status.HTTP_304_NOT_MODIFIED, error.headers
+
+
+def check_not_modified(etag: str, last_modified=None) -> dict:
+    """Returns the validator headers, or raises NotModified if the client's copy is current"""
+    headers = {"ETag": quote_etag(etag)}
+    if last_modified:
+        last_modified = last_modified.replace(microsecond=0)
+        headers["Last-Modified"] = http_date(last_modified)
+    if request.if_none_match:
+        # compressed responses carry the ETag with the encoding appended
+        tags = [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]
+        fresh = any(request.if_none_match.contains_weak(tag) for tag in tags)
+    else:
+        since = request.if_modified_since
+        fresh = bool(last_modified and since and last_modified <= since)
+    if fresh:
+        raise NotModified(headers)
+    return headers
+
+
+def list_columns(names: list, sort: str, by_rows: bool) -> list:
+    """Returns the columns a list reads: the requested fields, then the sort key its pages
+    are cut on and, when it is tagged by its rows, their id and version"""
+    keys = [column.key for column in Product.sort_columns(sort)[0]] if sort else []
+    keys = [name for name in dict.fromkeys(keys + (["id", "version"] if by_rows else [])) if name not in names]
+    return [getattr(Product, name) for name in names + keys]
+
+
+def collection_headers(products, mode: str, page: tuple = None, validators: bool = True, total: int = None) -> dict:
+    """Returns the ETag and X-Total-Count headers of a product list
+
+    Without a page, the list is summarized by Product.fingerprint() before
+    its rows are read and an exact count comes with it; the ETag is only left
+    out when validators is False and the count is estimated. A page, given as
+    the rows read and the next cursor, is tagged with the id and version of
+    those rows, so that no query runs over the other rows, and gets its Link headers.
+    A total, known when the rows read are the whole list, is sent as it is
+    instead of being counted or estimated.
+
+    :raises NotModified: if the client's copy is current
+    """
+    headers = {}
+    if page is not None:
+        rows, next_cursor = page
+        tag = "|".join([request.full_path, *(f"{row.id}-{row.version}" for row in rows), next_cursor or ""])
+        headers = check_not_modified(hashlib.sha1(tag.encode("utf-8")).hexdigest())
+        if next_cursor:
+            headers.update(page_headers(next_cursor))
+    elif validators or mode == "exact":
+        fingerprint = Product.fingerprint(products)
+        # deletes do not move the latest updated_at, so only the ETag is a safe validator here
+        tag = "|".join(str(value) for value in (request.full_path, *fingerprint))
+        headers = check_not_modified(hashlib.sha1(tag.encode("utf-8")).hexdigest())
+        headers["X-Total-Count"] = str(fingerprint[0])
+        return headers
+    if total is None:
+        total = Product.count(products) if mode == "exact" else Product.estimate_count(products)
+    headers["X-Total-Count"] = str(total)
+    return headers
+
+
+def serialize_with_pending_likes(product) -> dict:
+    """Serializes a product counting the likes still waiting in the buffer"""
+    data = product.serialize()
+    data["likes"] += like_buffer.pending(product.id)
+    return data
+
+
+def get_batch_payload() -> dict:
+    """Returns the body of a bulk update or delete request"""
+    data = api.payload
+    if not isinstance(data, dict):
+        abort(status.HTTP_400_BAD_REQUEST, "Request body must be an object")
+    if not isinstance(data.get("ids") or [], list) or not isinstance(data.get("filter") or {}, dict):
+        abort(status.HTTP_400_BAD_REQUEST, "ids must be a list and filter must be an object")
+    return data
+
+
+def get_filters(args) -> dict:
+    """Returns the arguments of find_by_filters() from the parsed query string
+
+    inputs.date parses into a datetime at midnight, which SQLite compares as
+    text after the date alone, so the date filters are reduced to dates.
+    """
+    filters = {name: args[name] for name in (*Product.FILTERS, *Product.RANGES)}
+    return {name: value.date() if isinstance(value, datetime) else value for name, value in filters.items()}
+
+
+def get_fields(value) -> list:
+    """Returns the product fields named in the fields parameter, all of them by default"""
+    if not value:
+        return list(serialize_product.fields)
+    names = list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+    unknown = [name for name in names if name not in serialize_product.fields]
+    if unknown or not names:
+        abort(status.HTTP_400_BAD_REQUEST, f"Invalid fields: {', '.join(unknown) or value}")
+    return names
+
+
+def get_page_limit(limit):
+    """Returns the page size to use, capped at PAGE_LIMIT_MAX"""
+    if limit is None:
+        return app.config["PAGE_LIMIT_DEFAULT"]
+    if limit < 1:
+        abort(status.HTTP_400_BAD_REQUEST, "limit must be a positive integer")
+    return min(limit, app.config["PAGE_LIMIT_MAX"])
+
+
+def page_headers(next_cursor: str, resource=None) -> dict:
+    """Returns the Link headers pointing at the next page of the current request"""
+    query = request.args.to_dict()
+    query["cursor"] = next_cursor
+    next_url = api.url_for(resource or ProductCollection, _external=True, **query)
+    return {"Link": f'<{next_url}>; rel="next"', "X-Next-Cursor": next_cursor}
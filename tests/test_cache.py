@@ -0,0 +1,112 @@
+"""
+Test cases for the Cache backends
+"""
+import time
+from unittest import TestCase
+from service.common.cache import AggregateCache, CacheBackend, LRUCache
+
+
+class TestLRUCache(TestCase):
+    """LRU Cache Tests"""
+
+    def test_get_and_set(self):
+        """It should return cached values and count hits and misses"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        self.assertIsNone(cache.get(1))
+        cache.set(1, "one")
+        self.assertEqual(cache.get(1), "one")
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_lru_eviction(self):
+        """It should evict the least recently used key"""
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set(1, "one")
+        cache.set(2, "two")
+        cache.get(1)
+        cache.set(3, "three")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), "one")
+        self.assertEqual(cache.get(3), "three")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_ttl_expiry(self):
+        """It should not return expired values"""
+        cache = LRUCache(maxsize=2, ttl=0.01)
+        cache.set(1, "one")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_delete_and_clear(self):
+        """It should invalidate keys"""
+        cache = LRUCache()
+        cache.set(1, "one")
+        cache.set(2, "two")
+        cache.set(3, "three")
+        cache.delete(1, 2, 4)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(3), "three")
+        cache.clear()
+        self.assertIsNone(cache.get(3))
+
+
+class TestCacheBackend(TestCase):
+    """Cache Backend Tests"""
+
+    def test_disabled_cache(self):
+        """It should never hold anything when maxsize is 0"""
+        cache = LRUCache(maxsize=0)
+        cache.set(1, "one")
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_backend_interface(self):
+        """It should require backends to implement every method"""
+        backend = CacheBackend()
+        self.assertRaises(NotImplementedError, backend.get, 1)
+        self.assertRaises(NotImplementedError, backend.set, 1, "one")
+        self.assertRaises(NotImplementedError, backend.delete, 1)
+        self.assertRaises(NotImplementedError, backend.clear)
+        self.assertRaises(NotImplementedError, backend.stats)
+
+
+class TestAggregateCache(TestCase):
+    """Aggregate Cache Tests"""
+
+    def test_apply(self):
+        """It should add and take away rows from the totals of their groups"""
+        cache = AggregateCache(ttl=60)
+        self.assertIsNone(cache.get("category"))
+        cache.set("category", {"books": [1, 5]}, cache.generation)
+        cache.apply({"category": "books"}, (1, 2))
+        cache.apply({"category": "toys"}, (1, 3))
+        self.assertEqual(cache.get("category"), {"books": [2, 7], "toys": [1, 3]})
+        cache.apply({"category": "toys"}, (-1, -3))
+        self.assertEqual(cache.get("category"), {"books": [2, 7]})
+        self.assertEqual(cache.stats()["groupings"], ["category"])
+        self.assertEqual((cache.stats()["hits"], cache.stats()["misses"]), (2, 1))
+
+    def test_stale_load(self):
+        """It should not keep totals loaded while a write happened"""
+        cache = AggregateCache(ttl=60)
+        generation = cache.generation
+        cache.apply({"category": "books"}, (1, 2))
+        cache.set("category", {"books": [1, 5]}, generation)
+        self.assertFalse(cache.loaded())
+        cache.set("category", {"books": [1, 5]}, cache.generation)
+        self.assertTrue(cache.loaded())
+        cache.clear()
+        self.assertIsNone(cache.get("category"))
+
+    def test_expired_and_disabled(self):
+        """It should reload expired totals and hold nothing when ttl is 0"""
+        cache = AggregateCache(ttl=0.01)
+        cache.set("category", {"books": [1, 5]}, cache.generation)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("category"))
+        cache = AggregateCache(ttl=0)
+        cache.set("category", {"books": [1, 5]}, cache.generation)
+        self.assertFalse(cache.loaded())
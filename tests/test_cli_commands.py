@@ -2,10 +2,13 @@
 CLI Command Extensions for Flask
 """
 import os
+import json
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from sqlalchemy.dialects import postgresql
+from service.common.cli_commands import db_create, db_index, db_migrate, db_seed, products_import, static_compress
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +24,87 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.inspect')
+    @patch('service.common.cli_commands.db')
+    def test_db_index(self, db_mock, inspect_mock):
+        """It should call the db-index command"""
+        conn = db_mock.engine.connect.return_value.execution_options.return_value.__enter__.return_value
+        conn.execute.return_value.first.return_value = None
+        db_mock.engine.dialect.name = "postgresql"
+        inspect_mock.return_value.get_indexes.return_value = [{"name": "ix_product_stock"}, {"name": "product_pkey"}]
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_index)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("ix_product_available", result.output)
+            self.assertIn("Dropped retired index ix_product_stock", result.output)
+            self.assertNotIn("ix_product_create_date\n", result.output)
+        statements = [str(call.args[0]) for call in conn.execute.call_args_list]
+        self.assertEqual(statements[0], "SET statement_timeout = 0")
+        self.assertEqual(statements[-1], 'DROP INDEX CONCURRENTLY IF EXISTS "ix_product_stock"')
+
+    @patch('service.common.cli_commands.inspect')
+    @patch('service.common.cli_commands.db')
+    def test_db_migrate(self, db_mock, inspect_mock):
+        """It should add the missing columns with the db-migrate command"""
+        inspect_mock.return_value.get_columns.return_value = [{"name": "id"}, {"name": "name"}]
+        db_mock.engine.dialect = postgresql.dialect()
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_migrate)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Added column version", result.output)
+            self.assertNotIn("Added column name", result.output)
+            self.assertIn("Adding generated column search_vector, the table is locked", result.output)
+        conn = db_mock.engine.begin.return_value.__enter__.return_value
+        statements = [str(call.args[0]) for call in conn.execute.call_args_list]
+        self.assertEqual(statements[0], "SET LOCAL statement_timeout = 0")
+        self.assertIn("ALTER TABLE product ADD COLUMN version INTEGER DEFAULT '1' NOT NULL", statements)
+        self.assertTrue(any("ADD COLUMN search_vector TSVECTOR GENERATED ALWAYS AS" in sql for sql in statements))
+
+    @patch('service.common.cli_commands.import_products')
+    def test_products_import(self, import_mock):
+        """It should import a file and write the rejected records with the products-import command"""
+        def load(lines, fmt, reject, batch_size):
+            self.assertEqual((fmt, batch_size), ("ndjson", 500))
+            self.assertEqual(list(lines), ['{"name": "lamp"}\n'])
+            reject(1, '{"name": "lamp"}', "Invalid Product: missing price")
+            return {"imported": 0, "rejected": 1}
+
+        import_mock.side_effect = load
+        with tempfile.TemporaryDirectory() as folder, patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            feed = os.path.join(folder, "feed.jsonl")
+            with open(feed, "w", encoding="utf-8") as file:
+                file.write('{"name": "lamp"}\n')
+            result = self.runner.invoke(products_import, [feed, "--batch-size", "500"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn(f"Rejected 1 records, see {feed}.rejected.ndjson", result.output)
+            with open(f"{feed}.rejected.ndjson", encoding="utf-8") as errors:
+                self.assertEqual(
+                    json.loads(errors.read()),
+                    {"line": 1, "error": "Invalid Product: missing price", "record": '{"name": "lamp"}'},
+                )
+            os.rename(feed, os.path.join(folder, "feed.xml"))
+            result = self.runner.invoke(products_import, [os.path.join(folder, "feed.xml")])
+            self.assertNotEqual(result.exit_code, 0)
+            self.assertIn("use --format", result.output)
+
+    @patch('service.common.cli_commands.precompress_static')
+    def test_static_compress(self, precompress_mock):
+        """It should call the static-compress command"""
+        precompress_mock.return_value = ["service/static/js/rest_api.js.gz"]
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(static_compress)
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("1 files compressed", result.output)
+
+    @patch('service.common.cli_commands.seed_products')
+    @patch('service.common.cli_commands.db')
+    def test_db_seed(self, db_mock, seed_mock):
+        """It should load generated products with the db-seed command"""
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(db_seed, ["--count", "500", "--seed", "42"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Added 500 products", result.output)
+        seed_mock.assert_called_once()
+        self.assertEqual(seed_mock.call_args.args[0], db_mock.engine)
+        self.assertEqual(seed_mock.call_args.args[2:], (500, 42, 100000))
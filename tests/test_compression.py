@@ -0,0 +1,87 @@
+"""
+Test cases for response compression and precompressed static files
+"""
+import os
+import gzip
+import shutil
+import tempfile
+from unittest import TestCase
+import brotli
+from flask import Flask
+from service import config
+from service.common import status
+from service.common.compression import init_compression, precompress_static
+
+
+class TestCompression(TestCase):
+    """Compression Tests"""
+
+    def setUp(self):
+        """Runs before each test with a small app serving a temporary static folder"""
+        self.folder = tempfile.mkdtemp()
+        app = Flask(__name__, static_folder=self.folder, static_url_path="/static")
+        app.config.from_object(config)
+        app.config["TESTING"] = True
+        init_compression(app)
+
+        @app.route("/data")
+        def data():
+            return {"items": ["item"] * 500}
+
+        self.app = app
+        self.client = app.test_client()
+        with open(os.path.join(self.folder, "app.js"), "w", encoding="utf-8") as asset:
+            asset.write("console.log('hello');\n" * 200)
+        with open(os.path.join(self.folder, "app.3f2a9c1b.js"), "w", encoding="utf-8") as asset:
+            asset.write("console.log('fingerprinted');\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_compress_json(self):
+        """It should gzip or brotli compress large JSON responses"""
+        response = self.client.get("/data", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        self.assertIn(b"item", gzip.decompress(response.get_data()))
+        response = self.client.get("/data", headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertIn(b"item", brotli.decompress(response.get_data()))
+        response = self.client.get("/data")
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_small_response_not_compressed(self):
+        """It should not compress responses below the size threshold"""
+        self.app.config["COMPRESS_MIN_SIZE"] = 100000
+        response = self.client.get("/data", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Content-Encoding", response.headers)
+
+    def test_precompress_static(self):
+        """It should write gzip and brotli copies of large static files"""
+        written = precompress_static(self.folder, self.app.config["COMPRESS_MIMETYPES"], 1024)
+        path = os.path.join(self.folder, "app.js")
+        self.assertEqual(sorted(written), [path + ".br", path + ".gz"])
+        self.assertEqual(precompress_static(self.folder, self.app.config["COMPRESS_MIMETYPES"], 1024), [])
+
+        response = self.client.get("/static/app.js", headers={"Accept-Encoding": "br, gzip"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertEqual(response.mimetype, "text/javascript")
+        self.assertIn(b"hello", brotli.decompress(response.get_data()))
+        response.close()
+        response = self.client.get("/static/app.js")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertIn("Accept-Encoding", response.headers["Vary"])
+        response.close()
+
+    def test_fingerprinted_static_cached(self):
+        """It should let clients cache fingerprinted static files forever"""
+        response = self.client.get("/static/app.3f2a9c1b.js")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertIn("max-age=31536000", response.headers["Cache-Control"])
+        response.close()
+        response = self.client.get("/static/app.js")
+        self.assertNotIn("immutable", response.headers.get("Cache-Control", ""))
+        response.close()
@@ -0,0 +1,54 @@
+"""
+Test cases for the bulk loading steps shared by Seeding and Importing
+"""
+from datetime import date
+from unittest import TestCase
+from unittest.mock import MagicMock
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+from service.common.copying import analyze, batched, copy_line, copy_rows, insert_rows
+
+
+class TestCopying(TestCase):
+    """Copying Tests"""
+
+    def test_batched(self):
+        """It should split rows into lists of at most the batch size"""
+        self.assertEqual(list(batched(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(batched([], 2)), [])
+
+    def test_copy_line(self):
+        """It should format a row in the COPY text format"""
+        row = ("red lamp 1", 9.5, "made with care", "home", 0, date(2023, 7, 1), False, 3)
+        self.assertEqual(copy_line(row), "red lamp 1\t9.5\tmade with care\thome\t0\t2023-07-01\tf\t3\n")
+
+    def test_copy_line_escapes(self):
+        """It should escape values for the COPY text format"""
+        row = ("a\tb", 1.5, None, "c\\d\ne\r", 0, date(2023, 7, 1), False, 3)
+        self.assertEqual(copy_line(row), "a\\tb\t1.5\t\\N\tc\\\\d\\ne\\r\t0\t2023-07-01\tf\t3\n")
+
+    def test_copy_rows(self):
+        """It should send one COPY per batch"""
+        cursor = MagicMock()
+        copy_rows(cursor, "product", ("name", "stock"), [("lamp", 1), ("mug", 2), ("pen", 3)], 2)
+        self.assertEqual(cursor.copy_expert.call_count, 2)
+        sql, data = cursor.copy_expert.call_args_list[0].args
+        self.assertEqual(sql, 'COPY "product" ("name", "stock") FROM STDIN')
+        self.assertEqual(data.getvalue(), "lamp\t1\nmug\t2\n")
+
+    def test_insert_rows(self):
+        """It should insert the rows in batches"""
+        engine = create_engine("sqlite://")
+        table = Table("product", MetaData(), Column("id", Integer, primary_key=True), Column("name", String(63)))
+        table.metadata.create_all(engine)
+        with engine.begin() as conn:
+            insert_rows(conn, table, ("name",), [("lamp",), ("mug",), ("pen",)], 2)
+        with engine.connect() as conn:
+            self.assertEqual(conn.scalars(select(table.c.name)).all(), ["lamp", "mug", "pen"])
+
+    def test_analyze(self):
+        """It should analyze the table without the statement timeout"""
+        engine = MagicMock()
+        analyze(engine, "product")
+        conn = engine.begin.return_value.__enter__.return_value
+        statements = [str(call.args[0]) for call in conn.execute.call_args_list]
+        self.assertEqual(statements, ["SET LOCAL statement_timeout = 0", 'ANALYZE "product"'])
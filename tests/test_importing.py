@@ -0,0 +1,100 @@
+"""
+Test cases for the bulk Importing of products
+"""
+import io
+import json
+from datetime import date
+from unittest import TestCase
+from unittest.mock import patch
+from service.models import DataValidationError
+from service.common.importing import (
+    COLUMNS,
+    STAGING_TABLE,
+    detect_format,
+    import_products,
+    product_row,
+    read_records,
+)
+
+RECORD = {
+    "name": "red lamp", "price": 9.5, "desc": "made with care", "category": "home",
+    "stock": 3, "create_date": "2023-07-01", "available": True, "likes": 0,
+}
+ROW = ("red lamp", 9.5, "made with care", "home", 3, date(2023, 7, 1), True, 0)
+CSV = (
+    "name,price,desc,category,stock,create_date,available,likes\n"
+    "red lamp,9.5,made with care,home,3,2023-07-01,true,0\n"
+    "\"big, blue\nchair\",12,,home,0,2023-07-02,false,5\n"
+    "mug,cheap,,home,1,2023-07-03,true,0\n"
+)
+
+
+class TestImporting(TestCase):
+    """Importing Tests"""
+
+    def test_detect_format(self):
+        """It should tell the format from a file name or a Content-Type"""
+        self.assertEqual(detect_format("feed.CSV"), "csv")
+        self.assertEqual(detect_format("feed.jsonl"), "ndjson")
+        self.assertIsNone(detect_format("feed.xml"))
+        self.assertEqual(detect_format("text/csv; charset=utf-8", mimetypes=True), "csv")
+        self.assertEqual(detect_format("application/x-ndjson", mimetypes=True), "ndjson")
+        self.assertIsNone(detect_format(None, mimetypes=True))
+
+    def test_read_records(self):
+        """It should number the records by line, skipping blank lines"""
+        records = list(read_records(io.StringIO(CSV), "csv"))
+        self.assertEqual([number for number, _ in records], [2, 4, 5])
+        self.assertEqual(records[1][1]["name"], "big, blue\nchair")
+        lines = io.StringIO(json.dumps(RECORD) + "\n\n" + json.dumps(RECORD) + "\r\n")
+        self.assertEqual([number for number, _ in read_records(lines, "ndjson")], [1, 3])
+
+    def test_product_row(self):
+        """It should validate CSV and NDJSON records like a posted product"""
+        self.assertEqual(product_row(json.dumps(RECORD), "ndjson"), ROW)
+        records = [record for _, record in read_records(io.StringIO(CSV), "csv")]
+        self.assertEqual(product_row(records[0], "csv"), ROW)
+        self.assertEqual(product_row(records[1], "csv")[6], False)
+
+    def test_product_row_rejected(self):
+        """It should reject records that the products table would refuse"""
+        invalid = [
+            {**RECORD, "available": "yes"},
+            {**RECORD, "price": "9.5"},
+            {**RECORD, "price": float("inf")},
+            {**RECORD, "stock": 2**40},
+            {**RECORD, "name": "x" * 64},
+            {**RECORD, "name": None},
+            {**RECORD, "create_date": "July"},
+            {key: value for key, value in RECORD.items() if key != "likes"},
+        ]
+        for record in invalid:
+            with self.assertRaises(DataValidationError, msg=record):
+                product_row(json.dumps(record), "ndjson")
+        for text in ("{not json", "[1, 2]"):
+            self.assertRaises(DataValidationError, product_row, text, "ndjson")
+        records = [record for _, record in read_records(io.StringIO(CSV + "short,1\n"), "csv")]
+        self.assertRaisesRegex(DataValidationError, "price", product_row, records[2], "csv")
+        self.assertRaisesRegex(DataValidationError, "number of fields", product_row, records[3], "csv")
+
+    @patch("service.common.importing.db")
+    def test_import_products_copy(self, db_mock):
+        """It should COPY the valid rows into the staging table and move them in one transaction"""
+        db_mock.engine.dialect.name = "postgresql"
+        connection = db_mock.engine.raw_connection.return_value
+        cursor = connection.cursor.return_value.__enter__.return_value
+        rejected = []
+        counts = import_products(
+            io.StringIO(CSV), "csv", lambda *args: rejected.append(args), batch_size=1
+        )
+        self.assertEqual(counts, {"imported": 2, "rejected": 1})
+        self.assertEqual([(line, error[:22]) for line, _, error in rejected], [(5, "Invalid Product: price")])
+        self.assertEqual(cursor.copy_expert.call_count, 2)
+        sql, data = cursor.copy_expert.call_args_list[1].args
+        self.assertEqual(sql, f'COPY "{STAGING_TABLE}" ("' + '", "'.join(COLUMNS) + '") FROM STDIN')
+        self.assertEqual(data.getvalue(), "big, blue\\nchair\t12.0\t\thome\t0\t2023-07-02\tf\t5\n")
+        statements = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertEqual(statements[0], "SET LOCAL statement_timeout = 0")
+        self.assertTrue(statements[1].startswith(f'CREATE TEMPORARY TABLE "{STAGING_TABLE}" ON COMMIT DROP'))
+        self.assertTrue(statements[-1].startswith('INSERT INTO "product"'))
+        connection.commit.assert_called_once()
@@ -0,0 +1,66 @@
+"""
+Test cases for the Like Buffer
+"""
+import time
+from unittest import TestCase
+from service.common.like_buffer import LikeBuffer
+
+
+class TestLikeBuffer(TestCase):
+    """Like Buffer Tests"""
+
+    def setUp(self):
+        self.flushed = []
+        self.buffer = LikeBuffer(self.flushed.append, interval=60, max_pending=5)
+
+    def tearDown(self):
+        self.buffer.close()
+
+    def test_add_and_flush(self):
+        """It should aggregate likes per product until flushed"""
+        self.buffer.add(1)
+        self.buffer.add(1)
+        self.buffer.add(2, 2)
+        self.assertEqual(self.buffer.pending(1), 2)
+        self.assertEqual(self.buffer.pending(3), 0)
+        self.buffer.flush()
+        self.assertEqual(self.flushed, [{1: 2, 2: 2}])
+        self.assertEqual(self.buffer.pending(1), 0)
+        self.buffer.flush()
+        self.assertEqual(len(self.flushed), 1)
+
+    def test_flush_when_full(self):
+        """It should flush early once max_pending likes are waiting"""
+        for _ in range(5):
+            self.buffer.add(7)
+        deadline = time.monotonic() + 5
+        while not self.flushed and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.flushed, [{7: 5}])
+
+    def test_flush_on_close(self):
+        """It should flush pending likes when closed"""
+        self.buffer.add(3)
+        self.buffer.close()
+        self.assertEqual(self.flushed, [{3: 1}])
+
+    def test_flush_failure_keeps_likes(self):
+        """It should keep the likes when a flush fails"""
+        def fail_once(counts):
+            if not failures:
+                failures.append(counts)
+                raise RuntimeError("database is down")
+            self.flushed.append(counts)
+
+        failures = []
+        buffer = LikeBuffer(fail_once, interval=60)
+        buffer.add(4, 3)
+        with self.assertLogs("flask.app", "ERROR"):
+            buffer.flush()
+        self.assertEqual(buffer.pending(4), 3)
+        buffer.close()
+        self.assertEqual(self.flushed, [{4: 3}])
+
+    def test_bad_interval(self):
+        """It should not accept a flush interval that is not positive"""
+        self.assertRaises(ValueError, LikeBuffer, self.flushed.append, 0)
@@ -5,9 +5,14 @@ Test cases for Product Model
 import os
 import logging
 import unittest
+import threading
+from unittest.mock import patch
 from datetime import date
+import flask
+from sqlalchemy import text
 from werkzeug.exceptions import NotFound
-from service.models import Product, DataValidationError, db
+from service.models import Product, DataValidationError, OutOfStockError, db
+from service.models import start_query_accounting, end_query_accounting
 from service import app
 from tests.factories import ProductFactory
 
@@ -42,6 +47,8 @@ class TestProduct(unittest.TestCase):
         """ This runs before each test """
         db.session.query(Product).delete()  # clean up the last tests
         db.session.commit()
+        Product.cache.clear()
+        Product.totals.clear()
 
     def tearDown(self):
         """ This runs after each test """
@@ -333,3 +340,445 @@ class TestProduct(unittest.TestCase):
         data = {"id": 1, "name": "product1", "likes": "zero"}
         product = Product()
         self.assertRaises(DataValidationError, product.deserialize, data)
+
+    def test_paginate_by_id(self):
+        """It should page through Products by id with a cursor"""
+        for product in ProductFactory.create_batch(5):
+            product.create()
+        page, cursor = Product.paginate(Product.query, 2)
+        self.assertEqual(len(page), 2)
+        self.assertIsNotNone(cursor)
+        seen = [product.id for product in page]
+        while cursor:
+            page, cursor = Product.paginate(Product.query, 2, cursor=cursor)
+            seen.extend(product.id for product in page)
+        self.assertEqual(seen, sorted(product.id for product in Product.all()))
+
+    def test_paginate_by_price(self):
+        """It should page through Products by price and id"""
+        for price in [30.0, 10.0, 20.0, 10.0]:
+            ProductFactory(price=price).create()
+        page, cursor = Product.paginate(Product.query, 3, sort="price")
+        self.assertEqual([product.price for product in page], [10.0, 10.0, 20.0])
+        self.assertLess(page[0].id, page[1].id)
+        page, cursor = Product.paginate(Product.query, 3, sort="price", cursor=cursor)
+        self.assertEqual([product.price for product in page], [30.0])
+        self.assertIsNone(cursor)
+
+    def test_paginate_descending(self):
+        """It should page through Products by descending create_date and id"""
+        for day in [3, 1, 2, 2]:
+            ProductFactory(create_date=date(2023, 7, day)).create()
+        page, cursor = Product.paginate(Product.query, 3, sort="-create_date")
+        self.assertEqual([product.create_date.day for product in page], [3, 2, 2])
+        self.assertGreater(page[1].id, page[2].id)
+        page, cursor = Product.paginate(Product.query, 3, sort="-create_date", cursor=cursor)
+        self.assertEqual([product.create_date.day for product in page], [1])
+        self.assertIsNone(cursor)
+        self.assertRaises(DataValidationError, Product.paginate, Product.query, 2, "-")
+
+    def test_paginate_bad_cursor(self):
+        """It should not paginate with a bad sort or cursor"""
+        self.assertRaises(DataValidationError, Product.paginate, Product.query, 2, "foo")
+        self.assertRaises(DataValidationError, Product.paginate, Product.query, 2, "id", "not-a-cursor")
+        for product in ProductFactory.create_batch(3):
+            product.create()
+        _, cursor = Product.paginate(Product.query, 1, sort="price")
+        self.assertRaises(DataValidationError, Product.paginate, Product.query, 1, "id", cursor)
+
+    def test_search(self):
+        """It should Search the name and description, name matches first"""
+        ProductFactory(name="Garden chair", desc="A wooden chair for lamps and tables").create()
+        ProductFactory(name="Desk lamp", desc="Bright light").create()
+        ProductFactory(name="Red lamp", desc="A red lamp").create()
+        ProductFactory(name="Sofa", desc="Soft").create()
+        rows, cursor = Product.search(Product.query, "lamp", 10)
+        self.assertIsNone(cursor)
+        names = [row[0].name for row in rows]
+        self.assertEqual(sorted(names[:2]), ["Desk lamp", "Red lamp"])
+        self.assertEqual(names[2], "Garden chair")
+        rows, _ = Product.search(Product.query, '"red lamp" -chair', 10)
+        self.assertEqual([row[0].name for row in rows], ["Red lamp"])
+        rows, _ = Product.search(Product.query.with_entities(Product.name), "SOFA", 10, timeout=500)
+        self.assertEqual(rows[0][0], "Sofa")
+        self.assertEqual(Product.search(Product.query, "the", 10), ([], None))
+
+    def test_search_pages(self):
+        """It should page through search results by rank and id"""
+        for product in ProductFactory.create_batch(5, desc="matching words"):
+            product.create()
+        rows, cursor = Product.search(Product.query, "matching", 2)
+        seen = [row[0].id for row in rows]
+        while cursor:
+            rows, cursor = Product.search(Product.query, "matching", 2, cursor)
+            seen.extend(row[0].id for row in rows)
+        self.assertEqual(seen, sorted(product.id for product in Product.all()))
+        self.assertRaises(DataValidationError, Product.search, Product.query, "matching", 2, "not-a-cursor")
+
+    def test_search_updated(self):
+        """It should Search the current name of an updated Product"""
+        product = ProductFactory(name="Old name", desc="Unchanged")
+        product.create()
+        product.name = "Renamed"
+        product.update()
+        self.assertEqual(Product.search(Product.query, "old", 10), ([], None))
+        self.assertEqual(len(Product.search(Product.query, "renamed", 10)[0]), 1)
+
+    def test_stats(self):
+        """It should total the Products of each group in one query"""
+        ProductFactory(category="books", price=10.0, stock=2, likes=1, create_date=date(2023, 7, 1)).create()
+        ProductFactory(category="books", price=20.0, stock=3, likes=0, create_date=date(2023, 7, 2)).create()
+        ProductFactory(category="toys", price=5.0, stock=0, likes=4, available=False,
+                       create_date=date(2023, 7, 1)).create()
+        self.assertEqual(Product.stats("category"), [("books", 2, 5, 30.0, 1), ("toys", 1, 0, 5.0, 4)])
+        self.assertEqual([row[:2] for row in Product.stats("available")], [(False, 1), (True, 2)])
+        self.assertEqual([row[:2] for row in Product.stats("create_date")], [(date(2023, 7, 1), 2), (date(2023, 7, 2), 1)])
+        self.assertRaises(DataValidationError, Product.stats, "name")
+
+    def test_stats_cached(self):
+        """It should keep the cached stats current through creates, updates, deletes, purchases and likes"""
+        product = ProductFactory(category="books", price=10.0, stock=2, likes=0, available=True)
+        product.create()
+        self.assertEqual(Product.stats("category", cached=True), [("books", 1, 2, 10.0, 0)])
+        Product.stats("available", cached=True)
+        other = ProductFactory(category="toys", price=5.0, stock=1, likes=0, available=True)
+        other.create()
+        product = Product.find(product.id)
+        product.category = "games"
+        product.price = 12.0
+        product.update()
+        Product.purchase(other.id)
+        Product.add_likes({product.id: 3, other.id: 2})
+        with patch.object(db.session, "execute", side_effect=AssertionError("stats were not cached")):
+            cached = Product.stats("category", cached=True), Product.stats("available", cached=True)
+        self.assertEqual(cached, (Product.stats("category"), Product.stats("available")))
+        self.assertEqual(cached[0], [("games", 1, 2, 12.0, 3), ("toys", 1, 0, 5.0, 2)])
+        other.delete()
+        self.assertEqual(Product.stats("category", cached=True), [("games", 1, 2, 12.0, 3)])
+        Product.delete_many(ids=[product.id])
+        self.assertFalse(Product.totals.loaded())
+        self.assertEqual(Product.stats("category", cached=True), [])
+
+    def test_find_by_filters(self):
+        """It should Find Products matching several filters at once"""
+        ProductFactory(category="category1", stock=0, available=False).create()
+        ProductFactory(category="category1", stock=5, available=True).create()
+        ProductFactory(category="category2", stock=0, available=False).create()
+        found = Product.find_by_filters(category="category1", available=False)
+        self.assertEqual(found.count(), 1)
+        self.assertEqual(found.first().category, "category1")
+        self.assertFalse(found.first().available)
+        found = Product.find_by_filters(category="category1", stock=None)
+        self.assertEqual(found.count(), 2)
+        self.assertEqual(Product.find_by_filters().count(), 3)
+
+    def test_find_by_filters_ranges(self):
+        """It should Find Products within the range filters"""
+        for price, stock, day in [(5.0, 0, 1), (10.0, 3, 2), (20.0, 8, 3)]:
+            ProductFactory(price=price, stock=stock, create_date=date(2023, 7, day)).create()
+        found = Product.find_by_filters(min_price=10.0, max_price=None)
+        self.assertEqual(sorted(product.price for product in found), [10.0, 20.0])
+        found = Product.find_by_filters(max_price=10.0, min_stock=1)
+        self.assertEqual([product.price for product in found], [10.0])
+        found = Product.find_by_filters(created_after=date(2023, 7, 1), created_before=date(2023, 7, 3))
+        self.assertEqual([product.create_date for product in found], [date(2023, 7, 2)])
+        self.assertEqual(Product.find_by_filters(min_price=10.0, max_price=5.0).count(), 0)
+
+    def test_find_by_filters_unknown(self):
+        """It should not Find Products by an unknown filter"""
+        self.assertRaises(DataValidationError, Product.find_by_filters, likes=0)
+
+    def test_stream_products(self):
+        """It should Stream the Products of a query in id order"""
+        for product in ProductFactory.create_batch(5):
+            product.create()
+        streamed = list(Product.stream(Product.find_by_filters(), batch_size=2))
+        self.assertEqual([product.id for product in streamed], sorted(product.id for product in Product.all()))
+
+    def test_deserialize_bad_date(self):
+        """It should not deserialize a bad create_date"""
+        data = ProductFactory().serialize()
+        data["create_date"] = "yesterday"
+        product = Product()
+        self.assertRaises(DataValidationError, product.deserialize, data)
+
+    def test_create_many_products(self):
+        """It should Create many Products in batches"""
+        products = ProductFactory.create_batch(5)
+        errors = Product.create_many(products, batch_size=2)
+        self.assertEqual(errors, [None] * 5)
+        self.assertEqual(len(Product.all()), 5)
+        for product in products:
+            self.assertIsNotNone(product.id)
+            self.assertEqual(Product.find(product.id).name, product.name)
+
+    def test_create_many_with_bad_row(self):
+        """It should Create the good Products of a batch the database rejects"""
+        products = ProductFactory.create_batch(3)
+        products[1].name = "x" * 100  # longer than the column allows
+        errors = Product.create_many(products)
+        self.assertIsNone(errors[0])
+        self.assertIsNotNone(errors[1])
+        self.assertIsNone(errors[2])
+        self.assertEqual(len(Product.all()), 2)
+
+    def test_update_many_products(self):
+        """It should Update many Products in one statement"""
+        for category in ["category1", "category1", "category2"]:
+            ProductFactory(category=category, price=10.0).create()
+        count = Product.update_many({"price": 5.0, "create_date": "2020-01-01"}, filters={"category": "category1"})
+        self.assertEqual(count, 2)
+        for product in Product.find_by_category("category1"):
+            self.assertEqual(product.price, 5.0)
+            self.assertEqual(product.create_date, date(2020, 1, 1))
+        self.assertEqual(Product.find_by_category("category2").first().price, 10.0)
+        ids = [product.id for product in Product.all()]
+        self.assertEqual(Product.update_many({"available": False}, ids=ids[:1]), 1)
+        self.assertFalse(Product.find(ids[0]).available)
+
+    def test_update_many_bad_changes(self):
+        """It should not Update many Products with bad changes"""
+        product = ProductFactory()
+        product.create()
+        ids = [product.id]
+        self.assertRaises(DataValidationError, Product.update_many, {}, ids)
+        self.assertRaises(DataValidationError, Product.update_many, {"id": 5}, ids)
+        self.assertRaises(DataValidationError, Product.update_many, {"available": "no"}, ids)
+        self.assertRaises(DataValidationError, Product.update_many, {"create_date": "soon"}, ids)
+        self.assertRaises(DataValidationError, Product.update_many, {"name": "x" * 100}, ids)
+        self.assertRaises(DataValidationError, Product.update_many, {"price": 1.0})
+        self.assertRaises(DataValidationError, Product.update_many, {"price": 1.0}, ["1"])
+
+    def test_delete_many_products(self):
+        """It should Delete many Products in one statement"""
+        products = ProductFactory.create_batch(4)
+        for product in products:
+            product.create()
+        count = Product.delete_many(ids=[products[0].id, products[1].id, 0])
+        self.assertEqual(count, 2)
+        self.assertEqual(len(Product.all()), 2)
+        self.assertRaises(DataValidationError, Product.delete_many)
+        count = Product.delete_many(filters={"name": products[2].name})
+        self.assertGreaterEqual(count, 1)
+
+    def test_bulk_filters_checked(self):
+        """It should refuse bulk filters whose values do not fit their columns"""
+        ProductFactory(price=10.0, create_date=date(2023, 7, 1)).create()
+        for filters in ({"price": "cheap"}, {"stock": 1.5}, {"available": "yes"}, {"name": {"a": 1}},
+                        {"min_price": True}, {"created_after": "July"}, {"create_date": 20230701}):
+            self.assertRaises(DataValidationError, Product.delete_many, filters=filters)
+        self.assertEqual(Product.update_many({"stock": 1}, filters={"create_date": "2023-07-01", "min_price": 10}), 1)
+        self.assertEqual(Product.delete_many(filters={"created_before": "2023-07-02", "price": 10}), 1)
+
+    def test_purchase_product(self):
+        """It should Purchase a Product in one atomic update"""
+        product = ProductFactory(stock=3, available=True)
+        product.create()
+        purchased = Product.purchase(product.id, 2)
+        self.assertEqual(purchased.id, product.id)
+        self.assertEqual(purchased.stock, 1)
+        self.assertTrue(purchased.available)
+        purchased = Product.purchase(product.id)
+        self.assertEqual(purchased.stock, 0)
+        self.assertFalse(purchased.available)
+        self.assertNotIn("search_vector", vars(purchased))
+        found = Product.find(product.id)
+        self.assertEqual(found.stock, 0)
+        self.assertFalse(found.available)
+
+    def test_purchase_product_out_of_stock(self):
+        """It should not Purchase more than the stock of a Product"""
+        product = ProductFactory(stock=2, available=True)
+        product.create()
+        product_id = product.id
+        with app.test_request_context("/api/products"), self.assertRaises(OutOfStockError) as context:
+            start_query_accounting()
+            try:
+                Product.purchase(product_id, 3)
+            finally:
+                # the conflict is told from a missing Product in the same statement
+                self.assertEqual(flask.g.db_queries, 1)
+        self.assertTrue(context.exception.available)
+        self.assertEqual(context.exception.stock, 2)
+        self.assertEqual(Product.find(product_id).stock, 2)
+
+    def test_purchase_product_sold_concurrently(self):
+        """It should refuse a purchase that a concurrent one sold out, reporting the stock it started from"""
+        product = ProductFactory(stock=2, available=True)
+        product.create()
+        errors = []
+
+        def purchase():
+            with app.app_context():
+                try:
+                    Product.purchase(product.id, 2)
+                except OutOfStockError as error:
+                    errors.append(error)
+                finally:
+                    db.session.remove()
+
+        with db.engine.connect() as connection:
+            connection.execute(text("UPDATE product SET stock = 0, available = false WHERE id = :id"), {"id": product.id})
+            thread = threading.Thread(target=purchase)
+            thread.start()
+            # the purchase takes its snapshot, then waits for the row lock
+            thread.join(0.5)
+            connection.commit()
+        thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertTrue(errors[0].available)
+        self.assertEqual(errors[0].stock, 2)
+        db.session.expire_all()
+        self.assertEqual(Product.find(product.id).stock, 0)
+
+    def test_purchase_product_without_cte(self):
+        """It should Purchase with a plain UPDATE on databases that cannot run one in a CTE"""
+        product = ProductFactory(stock=3, available=True)
+        product.create()
+        with patch.object(db.engine.dialect, "name", "sqlite"):
+            self.assertEqual(Product.purchase(product.id, 3).stock, 0)
+            with self.assertRaises(OutOfStockError) as context:
+                Product.purchase(product.id)
+            self.assertIsNone(Product.purchase(0))
+        self.assertFalse(context.exception.available)
+        self.assertEqual(context.exception.stock, 0)
+
+    def test_purchase_product_not_found(self):
+        """It should not Purchase a Product that does not exist"""
+        self.assertIsNone(Product.purchase(0))
+
+    def test_add_likes(self):
+        """It should Add aggregated likes to many Products"""
+        products = ProductFactory.create_batch(2)
+        for product in products:
+            product.likes = 1
+            product.create()
+        Product.add_likes({products[0].id: 5, products[1].id: 2, 0: 1})
+        self.assertEqual(Product.find(products[0].id).likes, 6)
+        self.assertEqual(Product.find(products[1].id).likes, 3)
+
+    def test_find_cached(self):
+        """It should Find a Product through the cache"""
+        product = ProductFactory()
+        product.create()
+        misses = Product.cache.stats()["misses"]
+        found = Product.find_cached(product.id)
+        self.assertEqual(found.serialize(), product.serialize())
+        self.assertEqual(Product.cache.stats()["misses"], misses + 1)
+        hits = Product.cache.stats()["hits"]
+        found = Product.find_cached(str(product.id))
+        self.assertEqual(found.name, product.name)
+        self.assertEqual(Product.cache.stats()["hits"], hits + 1)
+        self.assertIsNone(Product.find_cached(0))
+        self.assertIsNone(Product.find_cached("not-an-id"))
+
+    def test_find_cached_pinned_to_primary(self):
+        """It should skip and refresh the cache for a client pinned to the primary"""
+        product = ProductFactory()
+        product.create()
+        Product.find_cached(product.id)
+        Product.cache.set(product.id, {**Product.cache.get(product.id), "name": "stale"})
+        self.assertEqual(Product.find_cached(product.id).name, "stale")
+        with app.test_request_context("/"):
+            flask.g.db_primary = True
+            self.assertEqual(Product.find_cached(product.id).name, product.name)
+        self.assertEqual(Product.find_cached(product.id).name, product.name)
+
+    def test_cache_invalidation(self):
+        """It should invalidate the cache when a Product changes"""
+        product = ProductFactory(stock=5, available=True)
+        product.create()
+        Product.find_cached(product.id)
+        product.name = "renamed"
+        product.update()
+        self.assertEqual(Product.find_cached(product.id).name, "renamed")
+        Product.purchase(product.id)
+        self.assertEqual(Product.find_cached(product.id).stock, 4)
+        likes = product.likes
+        Product.add_likes({product.id: 3})
+        self.assertEqual(Product.find_cached(product.id).likes, likes + 3)
+        Product.update_many({"price": 1.0}, ids=[product.id])
+        self.assertEqual(Product.find_cached(product.id).price, 1.0)
+        product = Product.find(product.id)
+        product.delete()
+        self.assertIsNone(Product.find_cached(product.id))
+
+    def test_version_bumped_on_write(self):
+        """It should bump the version and updated_at of a Product on every write"""
+        product = ProductFactory(stock=5, available=True)
+        product.create()
+        self.assertEqual(product.version, 1)
+        created_at = product.updated_at
+        self.assertIsNotNone(created_at)
+        product.name = "renamed"
+        product.update()
+        self.assertEqual(product.version, 2)
+        self.assertGreater(product.updated_at, created_at)
+        self.assertEqual(Product.purchase(product.id).version, 3)
+        Product.add_likes({product.id: 1})
+        Product.update_many({"price": 2.0}, ids=[product.id])
+        self.assertEqual(Product.find(product.id).version, 5)
+
+    def test_fingerprint(self):
+        """It should change the fingerprint of a query when its rows change"""
+        products = ProductFactory.create_batch(3)
+        for product in products:
+            product.create()
+        before = Product.fingerprint(Product.find_by_filters())
+        self.assertEqual(before[0], 3)
+        self.assertEqual(Product.fingerprint(Product.find_by_filters()), before)
+        products[0].delete()
+        self.assertNotEqual(Product.fingerprint(Product.find_by_filters()), before)
+        self.assertEqual(Product.fingerprint(Product.find_by_name("no such name")), (0, None, 0))
+
+    def test_estimate_count(self):
+        """It should estimate the rows of a query from the planner's statistics"""
+        for category in ["books"] * 4 + ["toys"]:
+            ProductFactory(category=category).create()
+        db.session.execute(text("ANALYZE product"))
+        db.session.commit()
+        self.assertEqual(Product.estimate_count(Product.find_by_filters()), 5)
+        self.assertAlmostEqual(Product.estimate_count(Product.find_by_filters(category="books")), 4, delta=1)
+        self.assertAlmostEqual(Product.estimate_count(Product.find_by_name("it's 100%")), 0, delta=1)
+
+    def test_query_accounting(self):
+        """It should count the statements and time of a request"""
+        with app.test_request_context("/api/products"):
+            start_query_accounting()
+            Product.all()
+            Product.all()
+            self.assertEqual(flask.g.db_queries, 2)
+            self.assertGreater(flask.g.db_time, 0)
+            self.assertEqual(list(flask.g.db_statements.values()), [2])
+            end_query_accounting()
+
+    def test_slow_query_log(self):
+        """It should log statements over the threshold with their parameters and route"""
+        threshold = app.config["SLOW_QUERY_THRESHOLD"]
+        app.config["SLOW_QUERY_THRESHOLD"] = 1e-9
+        try:
+            with app.test_request_context("/api/products/42"):
+                with self.assertLogs("flask.app", level="WARNING") as logs:
+                    Product.find(42)
+        finally:
+            app.config["SLOW_QUERY_THRESHOLD"] = threshold
+        self.assertIn("GET /api/products/42", logs.output[0])
+        self.assertIn("42", logs.output[0].split("parameters=")[1])
+
+    def test_n_plus_one_log(self):
+        """It should log a request that repeats one statement"""
+        products = ProductFactory.create_batch(3)
+        for product in products:
+            product.create()
+        threshold = app.config["N_PLUS_ONE_THRESHOLD"]
+        app.config["N_PLUS_ONE_THRESHOLD"] = 3
+        try:
+            with app.test_request_context("/api/products", method="GET"):
+                start_query_accounting()
+                for product in products:
+                    Product.find(product.id)
+                with self.assertLogs("flask.app", level="WARNING") as logs:
+                    end_query_accounting()
+        finally:
+            app.config["N_PLUS_ONE_THRESHOLD"] = threshold
+        self.assertIn("Possible N+1 in GET /api/products: 3 queries, 3 of them", logs.output[0])
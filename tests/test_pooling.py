@@ -0,0 +1,50 @@
+"""
+Test cases for the connection Pool telemetry
+"""
+from unittest import TestCase
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool
+from service.common.pooling import TimedQueuePool, pool_stats
+
+
+class TestTimedQueuePool(TestCase):
+    """Timed Queue Pool Tests"""
+
+    def setUp(self):
+        self.engine = create_engine(
+            "sqlite://", poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.01
+        )
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_checkout_stats(self):
+        """It should count checkouts and report the connections in use"""
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            stats = pool_stats(self.engine.pool)
+            self.assertEqual(stats["pool"], "TimedQueuePool")
+            self.assertEqual(stats["size"], 1)
+            self.assertEqual(stats["checked_out"], 1)
+            self.assertEqual(stats["overflow"], 0)
+        stats = pool_stats(self.engine.pool)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checked_in"], 1)
+        self.assertEqual(stats["checkouts"], 1)
+        self.assertGreaterEqual(stats["wait_seconds_max"], 0)
+        self.assertEqual(stats["wait_seconds_total"], stats["wait_seconds_max"])
+
+    def test_checkout_timeout(self):
+        """It should count checkouts that time out waiting for a connection"""
+        with self.engine.connect():
+            self.assertRaises(PoolTimeoutError, self.engine.connect)
+        stats = pool_stats(self.engine.pool)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertGreaterEqual(stats["wait_seconds_max"], 0.01)
+
+    def test_other_pools(self):
+        """It should only report the class of pools without a queue"""
+        engine = create_engine("sqlite://", poolclass=NullPool)
+        self.assertEqual(pool_stats(engine.pool), {"pool": "NullPool"})
@@ -0,0 +1,83 @@
+"""
+Test cases for routing reads to the Replicas
+"""
+from unittest import TestCase
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import select, text
+from service.common.replicas import PRIMARY_COOKIE, RoutingSession, init_replicas, pinned_to_primary, replica_binds
+
+
+class TestReplicas(TestCase):
+    """Replica Routing Tests"""
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+        self.app.config["SQLALCHEMY_BINDS"] = replica_binds("sqlite://, sqlite://", {"echo": False})
+        self.app.config["READ_YOUR_WRITES_WINDOW"] = 5
+        self.database = SQLAlchemy(self.app, session_options={"class_": RoutingSession})
+        init_replicas(self.app)
+        self.binds = []
+        self.pinned = []
+
+        @self.app.route("/read", methods=["GET", "POST"])
+        def read():
+            statement = select(text("1"))
+            self.binds.append(self.database.session.get_bind(clause=statement))
+            self.pinned.append(pinned_to_primary())
+            return "ok"
+
+        self.client = self.app.test_client()
+
+    def replicas(self):
+        """Returns the engines of the replicas"""
+        with self.app.app_context():
+            return [self.database.engines["replica0"], self.database.engines["replica1"]]
+
+    def test_replica_binds(self):
+        """It should build one bind per replica URI with the engine options"""
+        binds = replica_binds(" postgresql://a/db ,postgresql://b/db,", {"pool_size": 3})
+        self.assertEqual(
+            binds,
+            {
+                "replica0": {"pool_size": 3, "url": "postgresql://a/db"},
+                "replica1": {"pool_size": 3, "url": "postgresql://b/db"},
+            },
+        )
+        self.assertEqual(replica_binds(""), {})
+
+    def test_get_reads_from_replica(self):
+        """It should send the SELECTs of a GET to a replica"""
+        response = self.client.get("/read")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.binds[0], self.replicas())
+
+    def test_write_reads_from_primary(self):
+        """It should keep the queries of a write and the client's next reads on the primary"""
+        response = self.client.post("/read")
+        self.assertEqual(response.status_code, 200)
+        cookie = self.client.get_cookie(PRIMARY_COOKIE)
+        self.assertIsNotNone(cookie)
+        self.client.get("/read")
+        with self.app.app_context():
+            self.assertEqual(self.binds, [self.database.engine, self.database.engine])
+        self.assertEqual(self.pinned, [False, True])
+        self.assertFalse(pinned_to_primary())
+
+    def test_expired_window(self):
+        """It should go back to the replicas once the window has passed"""
+        self.client.set_cookie(PRIMARY_COOKIE, "0")
+        self.client.get("/read")
+        self.client.set_cookie(PRIMARY_COOKIE, "garbage")
+        self.client.get("/read")
+        for bind in self.binds:
+            self.assertIn(bind, self.replicas())
+        self.assertEqual(self.pinned, [False, False])
+
+    def test_no_replicas(self):
+        """It should not register anything without replicas"""
+        app = Flask(__name__)
+        init_replicas(app)
+        self.assertEqual(app.before_request_funcs, {})
+        self.assertEqual(app.after_request_funcs, {})
@@ -0,0 +1,141 @@
+"""
+Test cases for the Retry policy and Circuit Breaker
+"""
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from service.common.resilience import (
+    CircuitBreaker,
+    DatabaseUnavailableError,
+    is_transient,
+    retry_transient,
+)
+
+
+class QueryCanceled(Exception):
+    """Stands in for psycopg2's QueryCanceledError"""
+
+    pgcode = "57014"
+
+
+def disconnect():
+    """Returns the error of a dropped connection"""
+    return OperationalError("SELECT 1", {}, Exception("server closed the connection unexpectedly"))
+
+
+class TestIsTransient(TestCase):
+    """Transient Error Tests"""
+
+    def test_transient_errors(self):
+        """It should only treat disconnects and operational errors as transient"""
+        self.assertTrue(is_transient(disconnect()))
+        invalidated = ProgrammingError("SELECT 1", {}, Exception("closed"), connection_invalidated=True)
+        self.assertTrue(is_transient(invalidated))
+        self.assertFalse(is_transient(OperationalError("SELECT 1", {}, QueryCanceled())))
+        self.assertFalse(is_transient(IntegrityError("INSERT", {}, Exception("duplicate key"))))
+        self.assertFalse(is_transient(ValueError("bad")))
+
+
+class TestCircuitBreaker(TestCase):
+    """Circuit Breaker Tests"""
+
+    def test_opens_at_threshold(self):
+        """It should open after consecutive failures and reject calls"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(DatabaseUnavailableError) as context:
+            breaker.before_call()
+        self.assertGreater(context.exception.retry_after, 1)
+        self.assertEqual(breaker.stats(), {"state": "open", "failures": 2, "rejected": 1})
+
+    def test_success_resets_failures(self):
+        """It should only count consecutive failures"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_trial(self):
+        """It should let one trial call through after the reset timeout"""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        breaker.before_call()
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertRaises(DatabaseUnavailableError, breaker.before_call)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.reset()
+        self.assertEqual(breaker.stats()["rejected"], 0)
+
+
+@patch("service.common.resilience.time.sleep")
+class TestRetryTransient(TestCase):
+    """Retry Policy Tests"""
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failure_threshold=10, reset_timeout=30)
+        self.cleanup = MagicMock()
+
+    def test_retries_transient_errors(self, sleep):
+        """It should retry a transient error with jittered backoff"""
+        function = MagicMock(side_effect=[disconnect(), disconnect(), "ok"], __name__="function")
+        wrapped = retry_transient(self.breaker, tries=3, delay=0.1, max_delay=2, cleanup=self.cleanup)(function)
+        self.assertEqual(wrapped(1, key="value"), "ok")
+        function.assert_called_with(1, key="value")
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual(self.cleanup.call_count, 2)
+        pauses = [call.args[0] for call in sleep.call_args_list]
+        self.assertTrue(0 <= pauses[0] <= 0.2)
+        self.assertTrue(0 <= pauses[1] <= 0.4)
+        self.assertEqual(self.breaker.stats()["failures"], 0)
+
+    def test_does_not_retry_other_errors(self, sleep):
+        """It should raise other errors at once"""
+        function = MagicMock(side_effect=IntegrityError("INSERT", {}, Exception("duplicate")), __name__="function")
+        wrapped = retry_transient(self.breaker, tries=3)(function)
+        self.assertRaises(IntegrityError, wrapped)
+        self.assertEqual(function.call_count, 1)
+        sleep.assert_not_called()
+
+    def test_gives_up(self, sleep):
+        """It should raise DatabaseUnavailableError when the tries run out"""
+        function = MagicMock(side_effect=disconnect(), __name__="function")
+        wrapped = retry_transient(self.breaker, tries=3)(function)
+        self.assertRaises(DatabaseUnavailableError, wrapped)
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_time_budget(self, sleep):
+        """It should not start an attempt past the time budget"""
+        function = MagicMock(side_effect=disconnect(), __name__="function")
+        wrapped = retry_transient(self.breaker, tries=10, delay=100, max_delay=100, budget=0)(function)
+        self.assertRaises(DatabaseUnavailableError, wrapped)
+        self.assertEqual(function.call_count, 1)
+        sleep.assert_not_called()
+
+    def test_fails_fast_when_open(self, sleep):
+        """It should stop retrying and reject calls once the circuit opens"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        function = MagicMock(side_effect=disconnect(), __name__="function")
+        wrapped = retry_transient(breaker, tries=10)(function)
+        self.assertRaises(DatabaseUnavailableError, wrapped)
+        self.assertEqual(function.call_count, 2)
+        self.assertRaises(DatabaseUnavailableError, wrapped)
+        self.assertEqual(function.call_count, 2)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_nested_calls(self, sleep):
+        """It should only retry in the outermost call"""
+        inner = MagicMock(side_effect=[disconnect(), "ok"], __name__="inner")
+        wrapped_inner = retry_transient(self.breaker, tries=3)(inner)
+        wrapped_outer = retry_transient(self.breaker, tries=3)(wrapped_inner)
+        self.assertEqual(wrapped_outer(), "ok")
+        self.assertEqual(inner.call_count, 2)
+        self.assertEqual(sleep.call_count, 1)
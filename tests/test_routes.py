@@ -6,13 +6,18 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+import json
 import logging
 from unittest import TestCase
+from unittest.mock import patch
 from datetime import date
-# from unittest.mock import MagicMock, patch
+from prometheus_client import REGISTRY
+from sqlalchemy.exc import OperationalError
 from service import app
-from service.models import db, init_db, Product
+from service.models import db, init_db, circuit_breaker, Product, OutOfStockError
 from service.common import status  # HTTP Status Codes
+from service.common.resilience import QUERY_CANCELED, DatabaseUnavailableError
+from service.routes import like_buffer, get_filters, product_args
 
 from tests.factories import ProductFactory
 
@@ -22,12 +27,18 @@ DATABASE_URI = os.getenv(
 BASE_URL = "/api/products"
 CONTENT_TYPE_JSON = "application/json"
 
+
+def sample(name: str, **labels) -> float:
+    """Returns the current value of a metric sample, 0 if it was never recorded"""
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
 ######################################################################
 #  T E S T   C A S E S
 ######################################################################
 
 
-# pylint: disable=too-many-public-methods
+# pylint: disable=too-many-public-methods,too-many-lines
 class TestProductService(TestCase):
     """Product Server Tests"""
 
@@ -51,6 +62,7 @@ class TestProductService(TestCase):
         self.client = app.test_client()
         db.session.query(Product).delete()  # clean up the last tests
         db.session.commit()
+        Product.cache.clear()
 
     def tearDown(self):
         db.session.remove()
@@ -87,6 +99,98 @@ class TestProductService(TestCase):
         data = response.get_json()
         self.assertEqual(data["status"], "OK")
 
+    def test_db_pool_stats(self):
+        """It should report the pool and give connections back after each request"""
+        self._create_products(1)
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get("/db/pool/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(data["checked_out"], 0)
+        self.assertGreater(data["checkouts"], 0)
+
+    def test_database_unavailable(self):
+        """It should answer 503 with Retry-After when the database is down"""
+        app.config["TESTING"] = False
+        try:
+            with patch("service.models.Product.find_by_filters", side_effect=DatabaseUnavailableError("down", 12)):
+                response = self.client.get(BASE_URL)
+        finally:
+            app.config["TESTING"] = True
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.headers["Retry-After"], "12")
+        self.assertEqual(response.get_json()["message"], "down")
+
+    def test_list_reads_are_retried(self):
+        """It should retry and answer 503 when reading a whole list or an export fails"""
+        ProductFactory().create()
+        lost = OperationalError("SELECT", {}, Exception("server closed the connection unexpectedly"))
+        app.config["TESTING"] = False
+        try:
+            for url in (BASE_URL, f"{BASE_URL}?sort=price", f"{BASE_URL}/export"):
+                with patch("sqlalchemy.orm.Session.execute", side_effect=lost) as execute:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE, url)
+                self.assertGreater(execute.call_count, 1, url)
+                circuit_breaker.reset()
+        finally:
+            app.config["TESTING"] = True
+            circuit_breaker.reset()
+
+    def test_data_validation_error_in_production(self):
+        """It should answer 400 for invalid data inside API resources when exceptions do not propagate"""
+        requests = [
+            ("GET", f"{BASE_URL}?cursor=abc&limit=1", None),
+            ("GET", f"{BASE_URL}/search?q=a&cursor=zz", None),
+            ("DELETE", f"{BASE_URL}/batch", {"filter": {"nope": 1}}),
+            ("PATCH", f"{BASE_URL}/batch", {"filter": {"nope": 1}, "changes": {"stock": 1}}),
+        ]
+        app.config["TESTING"] = False
+        try:
+            for method, url, body in requests:
+                response = self.client.open(url, method=method, json=body)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, f"{method} {url}")
+                self.assertEqual(response.get_json()["error"], "Bad Request")
+        finally:
+            app.config["TESTING"] = True
+
+    def test_request_metrics(self):
+        """It should record latency, size and SQL work per resource method"""
+        self._create_products(1)
+        label = "ProductCollection.get"
+        requests = sample("http_request_duration_seconds_count", endpoint=label)
+        answered = sample("http_requests_total", endpoint=label, status="200")
+        sizes = sample("http_response_size_bytes_sum", endpoint=label)
+        queries = sample("db_queries_per_request_sum", endpoint=label)
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sample("http_request_duration_seconds_count", endpoint=label), requests + 1)
+        self.assertEqual(sample("http_requests_total", endpoint=label, status="200"), answered + 1)
+        self.assertEqual(sample("http_response_size_bytes_sum", endpoint=label), sizes + len(response.data))
+        self.assertGreaterEqual(sample("db_queries_per_request_sum", endpoint=label), queries + 1)
+        self.assertGreater(sample("db_time_per_request_seconds_count", endpoint=label), 0)
+        self.assertEqual(sample("http_requests_in_progress"), 0)
+
+    def test_request_metrics_labels(self):
+        """It should label requests with the resource class and method"""
+        response = self.client.get(f"{BASE_URL}/0")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertGreater(sample("http_requests_total", endpoint="ProductResource.get", status="404"), 0)
+        self.client.get("/health")
+        self.assertGreater(sample("http_requests_total", endpoint="health", status="200"), 0)
+
+    def test_metrics(self):
+        """It should serve the metrics in the Prometheus text format"""
+        self.client.get("/health")
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        body = response.get_data(as_text=True)
+        self.assertIn("http_request_duration_seconds_bucket", body)
+        self.assertIn("db_queries_per_request_bucket", body)
+        self.assertIn("http_requests_in_progress 1.0", body)
+
     def test_get_product(self):
         """It should Get a single Product"""
         # get the id of a product
@@ -96,6 +200,100 @@ class TestProductService(TestCase):
         data = response.get_json()
         self.assertEqual(data["name"], test_product.name)
 
+    def test_get_product_cached(self):
+        """It should Get a Product from the cache after it changes"""
+        test_product = self._create_products(1)[0]
+        self.client.get(f"{BASE_URL}/{test_product.id}")
+        response = self.client.get(f"{BASE_URL}/{test_product.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = self.client.get("/cache/stats").get_json()
+        self.assertGreaterEqual(stats["hits"], 1)
+
+        data = response.get_json()
+        data["name"] = "renamed"
+        response = self.client.put(f"{BASE_URL}/{test_product.id}", json=data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(f"{BASE_URL}/{test_product.id}")
+        self.assertEqual(response.get_json()["name"], "renamed")
+
+        response = self.client.delete(f"{BASE_URL}/{test_product.id}")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(f"{BASE_URL}/{test_product.id}")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_product_conditional(self):
+        """It should answer a conditional Get with 304 until the Product changes"""
+        test_product = ProductFactory(stock=5)
+        test_product.create()
+        response = self.client.get(f"{BASE_URL}/{test_product.id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers["ETag"]
+        last_modified = response.headers["Last-Modified"]
+
+        response = self.client.get(f"{BASE_URL}/{test_product.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.get_data(), b"")
+        self.assertEqual(response.headers["ETag"], etag)
+        response = self.client.get(f"{BASE_URL}/{test_product.id}", headers={"If-Modified-Since": last_modified})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.put(f"{BASE_URL}/{test_product.id}/purchase")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(f"{BASE_URL}/{test_product.id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_list_products_conditional(self):
+        """It should answer a conditional list with 304 until the Products change"""
+        products = self._create_products(2)
+        response = self.client.get(BASE_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response.headers["ETag"]
+        self.assertNotIn("Last-Modified", response.headers)
+
+        response = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(BASE_URL + "?limit=1", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.delete(f"{BASE_URL}/{products[0].id}")
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.get(BASE_URL, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_list_page_conditional(self):
+        """It should tag a page by the rows it read, without summarizing the other pages"""
+        products = self._create_products(3)
+        with patch.object(Product, "fingerprint", side_effect=AssertionError("every row was summarized")):
+            response = self.client.get(BASE_URL, query_string={"limit": 2, "fields": "name"})
+            etag = response.headers["ETag"]
+            response = self.client.get(BASE_URL, query_string={"limit": 2, "fields": "name"},
+                                       headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.client.put(f"{BASE_URL}/{products[0].id}/like")
+            like_buffer.flush()
+            response = self.client.get(BASE_URL, query_string={"limit": 2, "fields": "name"},
+                                       headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.get_json()[0]), {"name"})
+
+    def test_get_product_conditional_compressed(self):
+        """It should match the ETag of a compressed response"""
+        min_size = app.config["COMPRESS_MIN_SIZE"]
+        app.config["COMPRESS_MIN_SIZE"] = 10
+        try:
+            test_product = self._create_products(1)[0]
+            headers = {"Accept-Encoding": "gzip"}
+            response = self.client.get(f"{BASE_URL}/{test_product.id}", headers=headers)
+            self.assertEqual(response.headers["Content-Encoding"], "gzip")
+            self.assertTrue(response.headers["ETag"].endswith('-gzip"'))
+            headers["If-None-Match"] = response.headers["ETag"]
+            response = self.client.get(f"{BASE_URL}/{test_product.id}", headers=headers)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        finally:
+            app.config["COMPRESS_MIN_SIZE"] = min_size
+
     def test_get_product_not_found(self):
         """It should not Get a Product thats not found"""
         response = self.client.get(f"{BASE_URL}/0")
@@ -141,6 +339,60 @@ class TestProductService(TestCase):
         products = response.get_json()
         self.assertEqual(len(products), 3)  # Should return all products
 
+    def test_list_products_total_count(self):
+        """It should return the exact or estimated number of matching Products in X-Total-Count"""
+        for category in ["books", "books", "toys"]:
+            ProductFactory(category=category).create()
+        for query in ({"limit": 1}, {}):
+            response = self.client.get(BASE_URL, query_string={"category": "books", "count": "exact", **query})
+            self.assertEqual(response.headers["X-Total-Count"], "2")
+        with patch.object(Product, "fingerprint", side_effect=AssertionError("every row was summarized")), \
+                patch.object(Product, "estimate_count", return_value=40) as estimate:
+            # a list read to its end counts its rows
+            for query in ({"limit": 5}, {}):
+                response = self.client.get(BASE_URL, query_string={"count": "estimated", **query})
+                self.assertEqual(response.headers["X-Total-Count"], "3")
+                self.assertIn("ETag", response.headers)
+            estimate.assert_not_called()
+            response = self.client.get(BASE_URL, query_string={"count": "estimated", "limit": 1})
+            self.assertEqual(response.headers["X-Total-Count"], "40")
+            response = self.client.get(BASE_URL, query_string={"count": "estimated", "limit": 5,
+                                                               "cursor": response.headers["X-Next-Cursor"]})
+            self.assertEqual(len(response.get_json()), 2)
+            self.assertEqual(response.headers["X-Total-Count"], "40")
+        response = self.client.get(BASE_URL, query_string={"count": "approximate"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_count_products(self):
+        """It should answer HEAD with the count and without reading any Product"""
+        for category in ["books", "books", "toys"]:
+            ProductFactory(category=category).create()
+        response = self.client.head(BASE_URL, query_string={"category": "books", "count": "exact"})
+        self.assertEqual((response.status_code, response.headers["X-Total-Count"]), (status.HTTP_200_OK, "2"))
+        self.assertEqual(response.data, b"")
+        response = self.client.head(BASE_URL, query_string={"category": "books", "count": "exact"},
+                                    headers={"If-None-Match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with patch.object(Product, "fingerprint", side_effect=AssertionError("the table was read")), \
+                patch.object(Product, "estimate_count", return_value=3):
+            response = self.client.head(BASE_URL, query_string={"count": "estimated"})
+        self.assertEqual(response.headers["X-Total-Count"], "3")
+        self.assertNotIn("ETag", response.headers)
+
+    def test_list_products_fast_json(self):
+        """It should List the same Products with and without the fast JSON path"""
+        self._create_products(5)
+        fast = self.client.get(BASE_URL)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.mimetype, CONTENT_TYPE_JSON)
+        app.config["FAST_JSON"] = False
+        try:
+            marshalled = self.client.get(BASE_URL)
+        finally:
+            app.config["FAST_JSON"] = True
+        self.assertEqual(marshalled.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.get_json(), marshalled.get_json())
+
     def test_list_products_with_name(self):
         """Test listing products with name filter"""
         # Create test products
@@ -300,6 +552,272 @@ class TestProductService(TestCase):
         filtered_products = response.get_json()
         self.assertEqual(len(filtered_products), 0)  # Should return an empty list
 
+    def test_list_products_by_id(self):
+        """It should list only the Product with the given id"""
+        products = self._create_products(3)
+        response = self.client.get(BASE_URL, query_string={"id": products[1].id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([product["id"] for product in response.get_json()], [products[1].id])
+        response = self.client.get(BASE_URL, query_string={"id": 0})
+        self.assertEqual(response.get_json(), [])
+
+    def test_list_products_with_multiple_filters(self):
+        """Test listing products with several filters combined"""
+        for category, stock, available in [("Category A", 0, False), ("Category A", 5, True), ("Category B", 0, False)]:
+            product = ProductFactory(category=category, stock=stock, available=available)
+            response = self.client.post(BASE_URL, json=product.serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get(BASE_URL, query_string={"category": "Category A", "available": "false"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        filtered_products = response.get_json()
+        self.assertEqual(len(filtered_products), 1)
+        self.assertEqual(filtered_products[0]["category"], "Category A")
+        self.assertEqual(filtered_products[0]["available"], False)
+
+        response = self.client.get(BASE_URL, query_string={"category": "Category A", "stock": 5, "available": "true"})
+        self.assertEqual(len(response.get_json()), 1)
+
+    def test_list_products_paginated(self):
+        """It should page through the Products list with a cursor"""
+        products = self._create_products(5)
+        response = self.client.get(BASE_URL + "?limit=2")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertIn('rel="next"', response.headers["Link"])
+        seen = [product["id"] for product in response.get_json()]
+        while "X-Next-Cursor" in response.headers:
+            cursor = response.headers["X-Next-Cursor"]
+            response = self.client.get(BASE_URL, query_string={"limit": 2, "cursor": cursor})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(product["id"] for product in response.get_json())
+        self.assertEqual(seen, sorted(product.id for product in products))
+        self.assertNotIn("Link", response.headers)
+
+    def test_list_products_paginated_by_price(self):
+        """It should page through the Products list by price"""
+        for price in [30.0, 10.0, 20.0]:
+            response = self.client.post(BASE_URL, json=ProductFactory(price=price).serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.get(BASE_URL + "?limit=2&sort=price")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([product["price"] for product in response.get_json()], [10.0, 20.0])
+        response = self.client.get(
+            BASE_URL, query_string={"limit": 2, "sort": "price", "cursor": response.headers["X-Next-Cursor"]}
+        )
+        self.assertEqual([product["price"] for product in response.get_json()], [30.0])
+
+    def test_list_products_with_ranges(self):
+        """It should list the Products within price, stock and date ranges"""
+        for price, stock, day in [(5.0, 0, 1), (10.0, 3, 2), (20.0, 8, 3), (40.0, 1, 4)]:
+            ProductFactory(price=price, stock=stock, create_date=date(2023, 7, day)).create()
+        response = self.client.get(BASE_URL, query_string={"min_price": 10, "max_price": 20, "sort": "price"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([product["price"] for product in response.get_json()], [10.0, 20.0])
+        response = self.client.get(BASE_URL, query_string={"min_stock": 1, "sort": "-stock"})
+        self.assertEqual([product["stock"] for product in response.get_json()], [8, 3, 1])
+        response = self.client.get(
+            BASE_URL, query_string={"created_after": "2023-07-01", "created_before": "2023-07-04", "sort": "-create_date"}
+        )
+        self.assertEqual([product["create_date"] for product in response.get_json()], ["2023-07-03", "2023-07-02"])
+        response = self.client.get(f"{BASE_URL}/export", query_string={"max_price": 5})
+        self.assertEqual([json.loads(line)["price"] for line in response.get_data(as_text=True).splitlines()], [5.0])
+        response = self.client.get(BASE_URL, query_string={"created_after": "July"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_date_filters_are_dates(self):
+        """It should filter by dates, not by datetimes at midnight"""
+        query_string = {"create_date": "2023-07-04", "created_after": "2023-07-01", "created_before": "2023-07-04"}
+        with app.test_request_context(BASE_URL, query_string=query_string):
+            filters = get_filters(product_args.parse_args())
+        for name, day in [("create_date", 4), ("created_after", 1), ("created_before", 4)]:
+            self.assertIs(type(filters[name]), date)
+            self.assertEqual(filters[name], date(2023, 7, day))
+        self.assertIsNone(filters["price"])
+
+    def test_list_products_paginated_descending(self):
+        """It should page through the Products list by descending price within a range"""
+        for price in [30.0, 10.0, 20.0, 20.0, 50.0]:
+            ProductFactory(price=price).create()
+        prices, ids, cursor, cursors = [], [], None, []
+        while True:
+            query = {"limit": 2, "sort": "-price", "max_price": 30, "fields": "id,price"}
+            response = self.client.get(BASE_URL, query_string={**query, "cursor": cursor} if cursor else query)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            prices.extend(product["price"] for product in response.get_json())
+            ids.extend(product["id"] for product in response.get_json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+            cursors.append(cursor)
+        self.assertEqual(prices, [30.0, 20.0, 20.0, 10.0])
+        self.assertGreater(ids[1], ids[2])
+        # a cursor only continues the ordering it came from
+        response = self.client.get(BASE_URL, query_string={"limit": 2, "sort": "price", "cursor": cursors[0]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_products_bad_page(self):
+        """It should not list Products with a bad limit or cursor"""
+        response = self.client.get(BASE_URL + "?limit=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL + "?cursor=garbage")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL + "?limit=2&sort=unknown")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(BASE_URL + "?sort=--price")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_products_sparse_fields(self):
+        """It should only return the requested fields"""
+        products = self._create_products(3)
+        for fast in (True, False):
+            app.config["FAST_JSON"] = fast
+            try:
+                response = self.client.get(BASE_URL + "?fields=id,name,price,available")
+            finally:
+                app.config["FAST_JSON"] = True
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.get_json()
+            self.assertEqual(len(data), 3)
+            for product in data:
+                self.assertEqual(list(product), ["id", "name", "price", "available"])
+            self.assertEqual(sorted(product["id"] for product in data), sorted(product.id for product in products))
+
+    def test_list_products_sparse_fields_paginated(self):
+        """It should page by a sort key that is not in the requested fields"""
+        for price in [30.0, 10.0, 20.0]:
+            response = self.client.post(BASE_URL, json=ProductFactory(price=price).serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        for fast in (True, False):
+            app.config["FAST_JSON"] = fast
+            try:
+                response = self.client.get(BASE_URL + "?limit=2&sort=price&fields=name")
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual([list(product) for product in response.get_json()], [["name"], ["name"]])
+                response = self.client.get(
+                    BASE_URL,
+                    query_string={"limit": 2, "sort": "price", "fields": "price", "cursor": response.headers["X-Next-Cursor"]},
+                )
+            finally:
+                app.config["FAST_JSON"] = True
+            self.assertEqual(response.get_json(), [{"price": 30.0}])
+
+    def test_list_products_bad_fields(self):
+        """It should not list Products with unknown fields"""
+        response = self.client.get(BASE_URL + "?fields=id,secret")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("secret", response.get_json()["message"])
+        response = self.client.get(BASE_URL + "?fields=,")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_products(self):
+        """It should Export the Products as newline-delimited JSON"""
+        products = self._create_products(3)
+        response = self.client.get(f"{BASE_URL}/export")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        lines = response.get_data(as_text=True).splitlines()
+        exported = [json.loads(line) for line in lines]
+        self.assertEqual([product["id"] for product in exported], sorted(product.id for product in products))
+        self.assertEqual(exported[0]["name"], min(products, key=lambda product: product.id).name)
+
+    def test_export_products_with_filters(self):
+        """It should Export only the Products matching the filters"""
+        for category in ["Category A", "Category B", "Category A"]:
+            response = self.client.post(BASE_URL, json=ProductFactory(category=category).serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.get(f"{BASE_URL}/export?category=Category%20B")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])["category"], "Category B")
+
+    def test_search_products(self):
+        """It should Search the Products one page at a time"""
+        for name in ["Desk lamp", "Red lamp", "Chair"]:
+            ProductFactory(name=name, desc="Furniture").create()
+        response = self.client.get(f"{BASE_URL}/search", query_string={"q": "lamp", "limit": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        first = response.get_json()
+        self.assertEqual(len(first), 1)
+        self.assertIn("/api/products/search?", response.headers["Link"])
+        response = self.client.get(
+            f"{BASE_URL}/search", query_string={"q": "lamp", "limit": 1, "cursor": response.headers["X-Next-Cursor"]}
+        )
+        second = response.get_json()
+        self.assertEqual(sorted([first[0]["name"], second[0]["name"]]), ["Desk lamp", "Red lamp"])
+        self.assertNotIn("Link", response.headers)
+        self.assertEqual(set(second[0]), {"id", "name", "price", "desc", "category", "stock", "create_date",
+                                          "available", "likes"})
+        app.config["FAST_JSON"] = False
+        try:
+            response = self.client.get(f"{BASE_URL}/search", query_string={"q": "chair"})
+        finally:
+            app.config["FAST_JSON"] = True
+        self.assertEqual([product["name"] for product in response.get_json()], ["Chair"])
+
+    def test_search_products_bad_request(self):
+        """It should not Search without words"""
+        response = self.client.get(f"{BASE_URL}/search")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(f"{BASE_URL}/search", query_string={"q": "  "})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_products_timeout(self):
+        """It should answer 503 when a search runs out of time"""
+        canceled = OperationalError("SELECT", {}, Exception("canceling statement due to statement timeout"))
+        canceled.orig.pgcode = QUERY_CANCELED
+        with patch.object(Product, "search", side_effect=canceled):
+            response = self.client.get(f"{BASE_URL}/search", query_string={"q": "lamp"})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        with patch.object(Product, "search", side_effect=OperationalError("SELECT", {}, Exception("gone"))):
+            self.assertRaises(OperationalError, self.client.get, f"{BASE_URL}/search", query_string={"q": "lamp"})
+
+    def test_product_stats(self):
+        """It should return the count, stock, average price and likes of each group"""
+        ProductFactory(category="books", price=10.0, stock=2, likes=1, create_date=date(2023, 7, 1)).create()
+        ProductFactory(category="books", price=20.0, stock=3, likes=0, create_date=date(2023, 7, 1)).create()
+        response = self.client.get(f"{BASE_URL}/stats")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json(), [
+            {"category": "books", "count": 2, "total_stock": 5, "average_price": 15.0, "total_likes": 1}
+        ])
+        Product.totals.clear()
+        response = self.client.get(f"{BASE_URL}/stats", query_string={"group_by": "create_date", "cached": "true"})
+        self.assertEqual(response.get_json()[0]["create_date"], "2023-07-01")
+        response = self.client.get(f"{BASE_URL}/stats", query_string={"group_by": "name"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_products(self):
+        """It should Import the Products of an NDJSON or CSV upload"""
+        products = [ProductFactory().serialize() for _ in range(3)]
+        products[1]["available"] = "yes"
+        body = "\n".join(json.dumps(product) for product in products) + "\n"
+        response = self.client.post(f"{BASE_URL}/import", data=body, content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        data = response.get_json()
+        self.assertEqual((data["imported"], data["rejected"]), (2, 1))
+        self.assertEqual(data["errors"][0]["line"], 2)
+        names = sorted(product.name for product in Product.all())
+        self.assertEqual(names, sorted([products[0]["name"], products[2]["name"]]))
+
+        body = "name,price,desc,category,stock,create_date,available,likes\n" \
+               "Lamp,9.5,\"tab\tand, comma\",home,3,2023-07-01,true,0\n"
+        response = self.client.post(f"{BASE_URL}/import", data=body.encode("utf-8"), content_type="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.get_json(), {"imported": 1, "rejected": 0, "errors": []})
+        product = Product.find_by_name("Lamp").one()
+        self.assertEqual(product.desc, "tab\tand, comma")
+        self.assertEqual(product.version, 1)
+
+    def test_import_products_bad_content_type(self):
+        """It should not Import an upload that is not CSV or NDJSON"""
+        response = self.client.post(f"{BASE_URL}/import", data="<products/>", content_type="application/xml")
+        self.assertEqual(response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+        response = self.client.post(f"{BASE_URL}/import", data=b"name\n\xff\n", content_type="text/csv")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(Product.all()), 0)
+
     def test_create_product(self):
         """It should Create a new Product"""
         test_product = ProductFactory()
@@ -335,6 +853,85 @@ class TestProductService(TestCase):
         # self.assertEqual(new_product["stock"], test_product.stock)
         # self.assertEqual(new_product["create_date"], test_product.create_date)
 
+    def test_create_products_batch(self):
+        """It should Create a batch of Products"""
+        products = [ProductFactory().serialize() for _ in range(3)]
+        response = self.client.post(f"{BASE_URL}/batch", json=products)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = response.get_json()
+        self.assertEqual(data["created"], 3)
+        self.assertEqual(data["failed"], 0)
+        for index, result in enumerate(data["results"]):
+            self.assertEqual(result["index"], index)
+            self.assertEqual(result["status"], status.HTTP_201_CREATED)
+            self.assertEqual(result["product"]["name"], products[index]["name"])
+            response = self.client.get(f"{BASE_URL}/{result['product']['id']}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_create_products_batch_with_errors(self):
+        """It should report the invalid items of a batch"""
+        products = [ProductFactory().serialize() for _ in range(3)]
+        del products[1]["name"]
+        response = self.client.post(f"{BASE_URL}/batch", json=products)
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        data = response.get_json()
+        self.assertEqual(data["created"], 2)
+        self.assertEqual(data["failed"], 1)
+        self.assertEqual(data["results"][1]["status"], status.HTTP_400_BAD_REQUEST)
+        self.assertIn("missing name", data["results"][1]["error"])
+        self.assertEqual(len(self.client.get(BASE_URL).get_json()), 2)
+
+    def test_create_products_batch_not_a_list(self):
+        """It should not Create a batch that is not a list"""
+        response = self.client.post(f"{BASE_URL}/batch", json=ProductFactory().serialize())
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(f"{BASE_URL}/batch", json=[])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_products_batch_too_large(self):
+        """It should not Create a batch larger than BATCH_MAX_ITEMS"""
+        max_items = app.config["BATCH_MAX_ITEMS"]
+        app.config["BATCH_MAX_ITEMS"] = 2
+        try:
+            products = [ProductFactory().serialize() for _ in range(3)]
+            response = self.client.post(f"{BASE_URL}/batch", json=products)
+            self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        finally:
+            app.config["BATCH_MAX_ITEMS"] = max_items
+
+    def test_update_products_batch(self):
+        """It should Update a batch of Products"""
+        for category in ["Category A", "Category A", "Category B"]:
+            response = self.client.post(BASE_URL, json=ProductFactory(category=category).serialize())
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.patch(
+            f"{BASE_URL}/batch", json={"filter": {"category": "Category A"}, "changes": {"price": 1.5}}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["updated"], 2)
+        prices = [product["price"] for product in self.client.get(BASE_URL + "?category=Category%20A").get_json()]
+        self.assertEqual(prices, [1.5, 1.5])
+
+    def test_update_products_batch_bad_data(self):
+        """It should not Update a batch of Products with bad data"""
+        response = self.client.patch(f"{BASE_URL}/batch", json={"ids": [1], "changes": {"id": 2}})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(f"{BASE_URL}/batch", json={"changes": {"price": 2}})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(f"{BASE_URL}/batch", json={"ids": 1, "changes": {"price": 2}})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(f"{BASE_URL}/batch", json=[1, 2])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_delete_products_batch(self):
+        """It should Delete a batch of Products"""
+        products = self._create_products(3)
+        response = self.client.delete(f"{BASE_URL}/batch", json={"ids": [products[0].id, products[1].id]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["deleted"], 2)
+        remaining = self.client.get(BASE_URL).get_json()
+        self.assertEqual([product["id"] for product in remaining], [products[2].id])
+
     def test_delete_product(self):
         """It should Delete a Product"""
         test_product = self._create_products(1)[0]
@@ -361,6 +958,15 @@ class TestProductService(TestCase):
         updated_product = response.get_json()
         self.assertEqual(updated_product["likes"], old_like + 1)
 
+        # the like is buffered until the next flush
+        response = self.client.put(f"{BASE_URL}/{new_product['id']}/like")
+        self.assertEqual(response.get_json()["likes"], old_like + 2)
+        response = self.client.get(f"{BASE_URL}/{new_product['id']}?pending_likes=true")
+        self.assertEqual(response.get_json()["likes"], old_like + 2)
+        like_buffer.flush()
+        response = self.client.get(f"{BASE_URL}/{new_product['id']}")
+        self.assertEqual(response.get_json()["likes"], old_like + 2)
+
     def test_purchase_product(self):
         """It should Purchase a Product"""
         test_product = ProductFactory()
@@ -419,6 +1025,31 @@ class TestProductService(TestCase):
         self.assertEqual(updated_product["stock"], 0)
         self.assertEqual(updated_product["available"], False)
 
+    def test_purchase_product_quantity(self):
+        """It should Purchase several units of a Product"""
+        test_product = ProductFactory(stock=5, available=True)
+        response = self.client.post(BASE_URL, json=test_product.serialize())
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        product_id = response.get_json()["id"]
+
+        response = self.client.put(f"{BASE_URL}/{product_id}/purchase?quantity=3")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.get_json()["stock"], 2)
+
+        response = self.client.put(f"{BASE_URL}/{product_id}/purchase?quantity=3")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("has only 2 in stock", response.get_json()["message"])
+
+        response = self.client.put(f"{BASE_URL}/{product_id}/purchase?quantity=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_purchase_product_sold_concurrently(self):
+        """It should answer 409 when a concurrent purchase took the stock that was read"""
+        with patch.object(Product, "purchase", side_effect=OutOfStockError(True, 3)):
+            response = self.client.put(f"{BASE_URL}/7/purchase?quantity=3")
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.get_json()["message"], "product with id [7] was just purchased by someone else.")
+
     ######################################################################
     #  T E S T   S A D   P A T H S
     ######################################################################
@@ -0,0 +1,69 @@
+"""
+Test cases for the synthetic data Seeding
+"""
+from datetime import date
+from collections import Counter
+from unittest import TestCase
+from unittest.mock import MagicMock
+from sqlalchemy import Boolean, Column, Date, Float, Integer, MetaData, String, Table, create_engine, func, select
+from service.common.seeding import CATEGORIES, COLUMNS, generate_products, seed_products
+
+TODAY = date(2023, 7, 1)
+
+
+class TestSeeding(TestCase):
+    """Seeding Tests"""
+
+    def test_generate_products(self):
+        """It should generate the same valid rows for the same seed"""
+        rows = list(generate_products(2000, seed=7, today=TODAY))
+        self.assertEqual(rows, list(generate_products(2000, seed=7, today=TODAY)))
+        self.assertNotEqual(rows, list(generate_products(2000, seed=8, today=TODAY)))
+        for name, price, desc, category, stock, create_date, available, likes in rows:
+            self.assertLessEqual(len(name), 63)
+            self.assertLessEqual(len(desc), 256)
+            self.assertGreater(price, 0)
+            self.assertIn(category, CATEGORIES)
+            self.assertGreaterEqual(stock, 0)
+            self.assertLessEqual(create_date, TODAY)
+            self.assertFalse(available and stock == 0)
+            self.assertGreaterEqual(likes, 0)
+
+    def test_skewed_distributions(self):
+        """It should make a few categories and products much more popular than the rest"""
+        rows = list(generate_products(5000, seed=1, today=TODAY))
+        categories = Counter(row[3] for row in rows).most_common()
+        self.assertEqual(categories[0][0], CATEGORIES[0])
+        self.assertGreater(categories[0][1], 10 * categories[-1][1])
+        out_of_stock = sum(1 for row in rows if row[4] == 0) / len(rows)
+        self.assertTrue(0.1 < out_of_stock < 0.2)
+        likes = sorted(row[7] for row in rows)
+        self.assertGreater(likes[-1], 100 * max(likes[len(likes) // 2], 1))
+
+    def test_seed_products(self):
+        """It should insert the rows in batches when COPY is not available"""
+        engine = create_engine("sqlite://")
+        table = Table(
+            "product", MetaData(),
+            Column("id", Integer, primary_key=True), Column("name", String(63)), Column("price", Float),
+            Column("desc", String(256)), Column("category", String(63)), Column("stock", Integer),
+            Column("create_date", Date), Column("available", Boolean), Column("likes", Integer),
+        )
+        table.metadata.create_all(engine)
+        self.assertEqual(seed_products(engine, table, 250, seed=3, batch_size=100), 250)
+        with engine.connect() as conn:
+            self.assertEqual(conn.scalar(select(func.count()).select_from(table)), 250)  # pylint: disable=not-callable
+
+    def test_seed_products_copy(self):
+        """It should stream the rows with COPY on PostgreSQL"""
+        engine = MagicMock()
+        engine.dialect.name = "postgresql"
+        table = MagicMock()
+        table.name = "product"
+        cursor = engine.raw_connection.return_value.cursor.return_value.__enter__.return_value
+        seed_products(engine, table, 250, seed=3, batch_size=100)
+        self.assertEqual(cursor.copy_expert.call_count, 3)
+        sql, data = cursor.copy_expert.call_args_list[0].args
+        self.assertEqual(sql, 'COPY "product" ("' + '", "'.join(COLUMNS) + '") FROM STDIN')
+        self.assertEqual(len(data.getvalue().splitlines()), 100)
+        engine.raw_connection.return_value.commit.assert_called_once()
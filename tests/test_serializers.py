@@ -0,0 +1,53 @@
+"""
+Test cases for the compiled Serializers
+"""
+import json
+from datetime import date
+from unittest import TestCase
+from flask_restx import Model, fields, marshal
+from service.common.serializers import compile_serializer, dumps
+
+MODEL = Model(
+    "Item",
+    {
+        "id": fields.Integer(),
+        "name": fields.String(),
+        "price": fields.Float(),
+        "available": fields.Boolean(),
+        "create_date": fields.Date(),
+    },
+)
+
+
+class TestSerializers(TestCase):
+    """Compiled Serializer Tests"""
+
+    def test_compile_serializer(self):
+        """It should build the same dict as marshal()"""
+        serialize = compile_serializer(MODEL)
+        self.assertEqual(serialize.fields, ["id", "name", "price", "available", "create_date"])
+        item = {"id": 1, "name": "hat", "price": 12, "available": True, "create_date": date(2023, 7, 1)}
+        row = tuple(item[name] for name in serialize.fields)
+        self.assertEqual(serialize(row), dict(marshal(item, MODEL)))
+
+    def test_compile_serializer_nulls(self):
+        """It should pass None values through"""
+        serialize = compile_serializer(MODEL)
+        self.assertEqual(serialize((None,) * 5), dict.fromkeys(serialize.fields))
+
+    def test_compile_serializer_with_names(self):
+        """It should only output the fields asked for, in order"""
+        serialize = compile_serializer(MODEL, ["name", "id"])
+        self.assertEqual(serialize.fields, ["name", "id"])
+        self.assertEqual(serialize(("hat", 1)), {"name": "hat", "id": 1})
+
+    def test_compile_serializer_unsupported(self):
+        """It should refuse fields it cannot compile"""
+        model = Model("Nested", {"tags": fields.List(fields.String)})
+        self.assertRaises(TypeError, compile_serializer, model)
+
+    def test_dumps(self):
+        """It should encode compact JSON bytes"""
+        data = dumps([{"id": 1, "name": "hat"}])
+        self.assertIsInstance(data, bytes)
+        self.assertEqual(json.loads(data), [{"id": 1, "name": "hat"}])